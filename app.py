@@ -1,77 +1,67 @@
 import streamlit as st
-from PIL import Image
-import os, io, time
+import os, time, json
+from datetime import datetime
 import pandas as pd
 import plotly.express as px
 from st_aggrid import AgGrid, GridOptionsBuilder, GridUpdateMode, DataReturnMode
 
 
 # ---- existing utils from your repo ----
-from utils.image_match import load_catalog_hashes, best_match
-from utils.serial_check import validate_serial
+from utils.image_match import INDEX_PATH, load_catalog_matrix, index_catalog
+from utils import upload_pipeline
+from utils.batch_scan import image_auth_scan, batch_scan, iter_zip_images
+from utils.serial_check import validate_serial, validate_serials, load_allowlist, add_to_allowlist, AllowList
 from utils.anomaly import prepare_dataframe, fit_isolation_forest, supplier_risk_table
-from utils.audit import log
+from utils.model_store import fit_reference_model, score_with_model, save_model, load_model, list_models
+from utils.segmented import MIN_SEGMENT_ROWS
+from utils.score_cache import SCORE_CACHE, cache_key
+from utils.ingest import read_table, cached_table, compact_frame, widen_floats, PRODUCT_DTYPES
+from utils.export import EXPORT_FORMATS, export_bytes
+from utils.audit import log, event_types, import_legacy_csv, query as audit_query
+from utils.risk_store import WINDOWS, merge_batch, window_risk, risk_windows, history_range
 from utils.report import generate_pdf
 
 # ---- product database imports (new) ----
 from utils.product_db import (
-    load_db, save_db, search_products,
+    load_db, save_db, search_products, get_product,
     distinct_brands, distinct_categories,
-    csv_template_path, blank_row
+    csv_template_path, blank_row, query_products, count_products, save_changes, delete_products,
+    COLUMNS as PRODUCT_COLUMNS, ORIG_ID,
 )
-
-# ---------- Quick Image Scan helper ----------
-def image_auth_scan(img_pil, catalog_hashes, dist_threshold, sim_threshold):
-    """
-    Returns a dict with best match and a clear verdict using your thresholds.
-    """
-    result = {
-        "best_file": None,
-        "distance": None,
-        "similarity": None,
-        "verdict": "No catalog images found",
-        "score": 0,
-        "explanation": ""
-    }
-    if not catalog_hashes:
-        result["explanation"] = "Add trusted images to data/catalog for visual matching."
-        return result
-
-    best, dist, sim = best_match(img_pil, catalog_hashes)
-    if best is None:
-        result["verdict"] = "Scan failed"
-        result["explanation"] = "Could not compute image similarity."
-        return result
-
-    # Weighted score (0–100): 70 from similarity, 30 from distance
-    sim_component = max(0.0, min(1.0, (sim or 0) / 100.0)) * 70
-    # Distance is 0 (best) to 64 (worst). Map to [0..1] where lower is better.
-    dist_component = 0.0
-    if dist is not None:
-        dist_component = max(0.0, min(1.0, (64 - float(dist)) / 64.0)) * 30
-
-    score = int(sim_component + dist_component)
-
-    # Verdict by thresholds you control from the sidebar
-    if (dist is not None and dist <= dist_threshold) and (sim is not None and sim >= sim_threshold):
-        verdict = "Authentic ✅"
-        explanation = f"Similarity {sim:.1f}% ≥ {sim_threshold} and Hamming {dist} ≤ {dist_threshold}."
-    elif sim is not None and sim >= (sim_threshold - 8):
-        verdict = "Needs Review ⚠️"
-        explanation = f"Close match (Similarity {sim:.1f}%). Distance {dist} vs threshold {dist_threshold}."
-    else:
-        verdict = "Suspected Counterfeit ❌"
-        explanation = f"Similarity {sim:.1f}% below threshold or image signature too different (Hamming {dist})."
-
-    result.update({
-        "best_file": best["file"],
-        "distance": dist,
-        "similarity": sim,
-        "verdict": verdict,
-        "score": score,
-        "explanation": explanation
-    })
-    return result
+from utils.paging import row_order, page_count
+
+PAGE_SIZES = [25, 50, 100, 250]
+PLOT_POINTS = 2000
+
+def log_changed(event, details):
+    """Audit an event once per distinct details in this session, not on every rerun."""
+    seen = st.session_state.setdefault("_audit_seen", {})
+    sig = repr(details)
+    if seen.get(event) == sig:
+        return False
+    seen[event] = sig
+    log(event, details)
+    return True
+
+def page_picker(key: str, total: int, page_size: int) -> int:
+    """Page number input for a server-side paged grid (clamped when the result set shrinks)."""
+    pages = page_count(total, page_size)
+    if st.session_state.get(key, 1) > pages:
+        st.session_state[key] = pages
+    p1, p2 = st.columns([1,4])
+    with p1:
+        page = st.number_input("Page", min_value=1, max_value=pages, step=1, key=key)
+    with p2:
+        st.caption(f"{total:,} rows · page {page} of {pages}")
+    return int(page)
+
+def current_risk(scored: pd.DataFrame, key) -> pd.DataFrame:
+    """supplier_risk_table for the current scored frame, computed once per result (key)."""
+    cached = st.session_state.get("current_risk")
+    if cached is None or cached[0] != key or key is None:
+        cached = (key, supplier_risk_table(scored))
+        st.session_state["current_risk"] = cached
+    return cached[1]
 
 # -------------------- Page & basic styling --------------------
 st.set_page_config(page_title="Supply Chain Transparency | Counterfeit Detection", layout="wide")
@@ -173,12 +163,21 @@ with tab1:
         st.markdown("**Or upload a product image:**")
         uploaded = st.file_uploader("📸 Upload Image", type=["jpg","jpeg","png","webp"], key="product_image_upload")
         auto_scan = st.toggle("Auto-scan uploaded image", value=True, key="auto_scan_toggle")
+        # Decode + hash on a worker thread while the rest of the page renders
+        upload_job = upload_pipeline.submit(uploaded.getvalue()) if uploaded is not None and auto_scan else None
 
     # ---------- RIGHT: Serial / QR ----------
     with col2:
         serial = st.text_input("🧾 Serial / QR Code", placeholder="e.g., APP-2025-123450")
         allowlist = st.text_area("Known-good serials (optional, one per line)")
-        allow = {s.strip().upper() for s in allowlist.splitlines() if s.strip()}
+        pasted = [s for s in allowlist.splitlines() if s.strip()]
+        saved_allow = load_allowlist()
+        if pasted and st.button(f"Add {len(pasted)} serial(s) to the saved allow-list", key="save_allowlist"):
+            added = add_to_allowlist(pasted)
+            log("allowlist_updated", {"added": added})
+            st.success(f"Added {added} new serial(s).")
+            saved_allow = load_allowlist()
+        st.caption(f"Saved allow-list: {len(saved_allow):,} serial(s)")
 
         serial_valid = None
         serial_details = None
@@ -186,39 +185,71 @@ with tab1:
             res = validate_serial(serial)
             serial_details = res
             serial_valid = res["valid"]
-            log("serial_checked", {"serial": res["normalized"], "valid": res["valid"]})
+            log_changed("serial_checked", {"serial": res["normalized"], "valid": res["valid"]})
             (st.success if res["valid"] else st.error)("Serial validation: " + ("✅ Valid" if res["valid"] else "⚠️ Invalid"))
             with st.expander("Validation details"):
                 st.json(res, expanded=False)
-            if allow:
-                st.info("Allow-list: " + ("✅ Found" if serial.strip().upper() in allow else "❌ Not found"))
+            if pasted or len(saved_allow):
+                found = bool(saved_allow.contains([serial])[0]) or bool(AllowList(pasted).contains([serial])[0])
+                st.info("Allow-list: " + ("✅ Found" if found else "❌ Not found"))
+
+        with st.expander("📋 Bulk validate serials (CSV / TXT)"):
+            bulk_file = st.file_uploader("One serial per line, or a CSV with a 'serial' column",
+                                         type=["csv", "txt"], key="bulk_serial_upload")
+            if bulk_file is not None and st.button("Validate all", key="run_bulk_serials"):
+                if bulk_file.name.lower().endswith(".csv"):
+                    bulk_in = pd.read_csv(bulk_file, dtype=str)
+                    col = "serial" if "serial" in bulk_in.columns else bulk_in.columns[0]
+                    serials = bulk_in[col]
+                else:
+                    serials = [s for s in bulk_file.getvalue().decode("utf-8", "replace").splitlines() if s.strip()]
+                bulk_df = validate_serials(serials, allowlist=saved_allow,
+                                           known_prefixes=load_db()["serial_prefix"].dropna().tolist())
+                if pasted:
+                    bulk_df["in_allowlist"] |= AllowList(pasted).contains(bulk_df["normalized"], normalized=True)
+                st.session_state["bulk_serials"] = bulk_df
+                log("serials_bulk_validated", {"rows": len(bulk_df), "valid": int(bulk_df["valid"].sum())})
+            if "bulk_serials" in st.session_state:
+                bulk_df = st.session_state["bulk_serials"]
+                st.caption(f"{len(bulk_df):,} serial(s) · {int(bulk_df['valid'].sum()):,} valid · "
+                           f"{int(bulk_df['in_allowlist'].sum()):,} on the allow-list · "
+                           f"{int((~bulk_df['prefix_known']).sum()):,} unknown prefix")
+                st.dataframe(bulk_df.head(1000), use_container_width=True, hide_index=True)
+                st.download_button("⬇️ Validation results (CSV)", bulk_df.to_csv(index=False).encode("utf-8"),
+                                   file_name="serial_validation.csv", mime="text/csv")
 
     st.markdown('</div>', unsafe_allow_html=True)
 
     # ---------- IMAGE SCAN (single implementation) ----------
-    catalog_hashes = load_catalog_hashes(CATALOG_DIR)
+    catalog_hashes = load_catalog_matrix(CATALOG_DIR)
 
     image_sim = None
     distance = None
     best_file = None
     scan_score = 0
-    scan_verdict = None
+    scan_verdict_label = None
 
-    if uploaded is not None and auto_scan:
-        img = Image.open(uploaded).convert("RGB")
+    decoded = None
+    if upload_job is not None:
+        try:
+            with st.spinner("Decoding image…"):
+                decoded = upload_job.result()
+        except Exception as e:
+            st.error(f"Could not read the uploaded image: {e}")
 
-        # Run scan (assumes you added image_auth_scan helper)
-        scan = image_auth_scan(img, catalog_hashes, dist_threshold, sim_threshold)
+    if decoded is not None:
+        scan = image_auth_scan(decoded["hashes"], catalog_hashes, dist_threshold, sim_threshold)
 
         best_file   = scan["best_file"]
         distance    = scan["distance"]
         image_sim   = scan["similarity"]
         scan_score  = scan["score"]
-        scan_verdict= scan["verdict"]
+        scan_verdict_label = scan["verdict"]
 
         left, right = st.columns([1,1], gap="large")
         with left:
-            st.image(img, caption="Uploaded Product Image", use_column_width=True)
+            w, h = decoded["original_size"]
+            st.image(decoded["preview"], caption=f"Uploaded Product Image ({w}×{h})", use_column_width=True)
 
         with right:
             st.markdown(
@@ -236,16 +267,15 @@ with tab1:
             )
             st.progress(max(0, min(1, scan["score"]/100.0)))
 
-            # Map best-file -> product details
-            product_id_from_file = None
-            if best_file:
-                product_id_from_file = os.path.basename(best_file).split("_")[0]
-            if product_id_from_file:
+            if scan["verdict"].startswith("Needs Review") and scan["alternatives"]:
+                st.markdown("**Other close catalog matches:**")
+                st.dataframe(pd.DataFrame(scan["alternatives"]), use_container_width=True, hide_index=True)
+
+            # Map the match -> product details (product_id as parsed by image_match.product_id_from_file)
+            if scan["product_id"]:
                 try:
-                    db = load_db()
-                    row = db[db["product_id"] == product_id_from_file]
-                    if len(row):
-                        info = row.iloc[0]
+                    info = get_product(scan["product_id"])
+                    if info:
                         st.markdown(
                             f"""
                             <div class="glass-card" style="margin-top:10px">
@@ -261,23 +291,51 @@ with tab1:
                     st.caption(f"(Could not map product details: {e})")
 
             # Log + session history
-            log("image_auto_scanned", {
+            new_scan = log_changed("image_auto_scanned", {
+                "file": uploaded.name,
                 "best_file": best_file,
                 "distance": distance,
                 "similarity": float(image_sim or 0),
                 "score": int(scan_score),
-                "verdict": scan_verdict
+                "verdict": scan_verdict_label
             })
             history = st.session_state.setdefault("scan_history", [])
-            history.append({
-                "file": uploaded.name,
-                "best_match": best_file,
-                "similarity": image_sim,
-                "distance": distance,
-                "score": scan_score,
-                "verdict": scan_verdict,
-                "time": time.strftime("%Y-%m-%d %H:%M:%S")
-            })
+            if new_scan:
+                history.append({
+                    "file": uploaded.name,
+                    "best_match": best_file,
+                    "similarity": image_sim,
+                    "distance": distance,
+                    "score": scan_score,
+                    "verdict": scan_verdict_label,
+                    "time": time.strftime("%Y-%m-%d %H:%M:%S")
+                })
+
+    # ---------- BATCH SCAN (shipment folders) ----------
+    with st.expander("📦 Batch scan (multiple images or a .zip)"):
+        batch_files = st.file_uploader(
+            "Upload images or zip archives",
+            type=["jpg","jpeg","png","webp","zip"],
+            accept_multiple_files=True,
+            key="batch_image_upload",
+        )
+        if batch_files and st.button("Run batch scan", key="run_batch_scan"):
+            items = []
+            for f in batch_files:
+                if f.name.lower().endswith(".zip"):
+                    items.extend(iter_zip_images(f.getvalue()))
+                else:
+                    items.append((f.name, f.getvalue()))
+            batch_df, batch_stats = batch_scan(items, catalog_hashes, dist_threshold, sim_threshold)
+            st.session_state["batch_scan"] = (batch_df, batch_stats)
+            log("image_batch_scanned", batch_stats)
+        if "batch_scan" in st.session_state:
+            batch_df, batch_stats = st.session_state["batch_scan"]
+            st.caption(f"{batch_stats['images']} image(s) in {batch_stats['seconds']}s · {batch_stats['images_per_sec']} images/sec")
+            st.dataframe(batch_df["verdict"].value_counts().rename_axis("verdict").reset_index(), hide_index=True)
+            st.dataframe(batch_df, use_container_width=True, hide_index=True)
+            st.download_button("⬇️ Batch results (CSV)", batch_df.to_csv(index=False).encode("utf-8"),
+                               file_name="batch_scan.csv", mime="text/csv")
 
     # ---------- Recent scans table ----------
     if "scan_history" in st.session_state and st.session_state["scan_history"]:
@@ -303,21 +361,73 @@ with tab1:
 # ==================== TAB 2: INVOICE ANOMALIES ====================
 with tab2:
     st.subheader("2) Transaction / Invoice Anomaly Detection")
-    st.write("CSV columns: `invoice_id,date,supplier,item,quantity,unit_price,lead_time_days,amount`.")
+    st.write("CSV, Parquet or Arrow with columns: `invoice_id,date,supplier,item,quantity,unit_price,lead_time_days,amount`.")
 
     sample_btn = st.toggle("Use bundled sample data", value=True)
+    raw, raw_name = None, None
     if sample_btn:
-        df = pd.read_csv(os.path.join("sample_data","sample_transactions.csv"))
-        log("sample_loaded", {"rows": len(df)})
+        raw_name = os.path.join("sample_data","sample_transactions.csv")
+        with open(raw_name, "rb") as f:
+            raw = f.read()
     else:
-        inv_file = st.file_uploader("Upload CSV", type=["csv"])
-        df = pd.read_csv(inv_file) if inv_file is not None else None
+        inv_file = st.file_uploader("Upload invoices", type=["csv","parquet","arrow","feather"])
         if inv_file is not None:
-            log("file_uploaded", {"name": inv_file.name})
-
-    if df is not None:
-        df_clean = prepare_dataframe(df)
-        df_scored, model = fit_isolation_forest(df_clean, contamination=contamination)
+            raw, raw_name = inv_file.getvalue(), inv_file.name
+            log_changed("file_uploaded", {"name": inv_file.name})
+
+    # Saved models score new uploads with inference only; "fit fresh" trains on this file
+    saved_models = list_models()
+    model_labels = ["Fit on this file"] + [f"{m['name']}:{m['version']}  ({m.get('created','')})" for m in saved_models]
+    model_choice = st.selectbox("Model", range(len(model_labels)), format_func=lambda i: model_labels[i], key="model_choice")
+
+    if model_choice == 0:
+        # Segmented baselines judge each invoice against its own supplier / item / item cluster
+        segment_labels = {None: "One global model", "supplier": "Per supplier", "item": "Per item",
+                          "supplier_item": "Per supplier × item", "cluster": "Per item cluster"}
+        segment_by = st.selectbox("Baseline", list(segment_labels), format_func=segment_labels.get, key="segment_by",
+                                  help=f"Segments with fewer than {MIN_SEGMENT_ROWS} invoices use the global model.")
+
+    if raw is not None:
+        # Results are cached by input bytes + parameters, so reruns skip parsing and scoring
+        if model_choice == 0:
+            key = cache_key(raw, contamination, 42, f"fresh-{segment_by or 'global'}")
+            def _fit_fresh():
+                # The parsed table is ours: prepare and score it in place, then shrink it for the cache
+                scored, bundle = fit_reference_model(cached_table(raw, raw_name), contamination=contamination,
+                                                     segment_by=segment_by, inplace=True)
+                return compact_frame(scored), bundle
+            df_scored, bundle = SCORE_CACHE.get_or_compute(key, _fit_fresh)
+            if segment_by:
+                st.caption(f"{bundle['n_segments']} {segment_labels[segment_by].lower()[4:]} models; "
+                           f"{int((df_scored['model_segment'] == 'global').sum())} invoices scored by the global model.")
+            with st.expander("💾 Save this model for scoring future uploads"):
+                model_name = st.text_input("Model name", value="baseline", key="model_name")
+                if st.button("Save model"):
+                    try:
+                        meta = save_model(model_name, bundle, notes=f"{bundle['trained_rows']} rows")
+                        log("model_saved", {"name": meta["name"], "version": meta["version"]})
+                        st.success(f"Saved {meta['name']}:{meta['version']}")
+                    except ValueError as e:
+                        st.error(str(e))
+        else:
+            chosen = saved_models[model_choice - 1]
+            # Versions whose .json is unreadable only list name / version / created; name:version keys the cache anyway
+            key = cache_key(raw, chosen.get("contamination") or 0.0, chosen.get("random_state", 42),
+                            f"{chosen['name']}:{chosen['version']}")
+            df_scored = SCORE_CACHE.get_or_compute(
+                key, lambda: compact_frame(score_with_model(cached_table(raw, raw_name),
+                                                            load_model(chosen["name"], chosen["version"]), inplace=True)))
+            st.caption(f"Scored with saved model {chosen['name']}:{chosen['version']} "
+                       f"(contamination {chosen.get('contamination', '?')}, trained on {chosen.get('trained_rows', '?')} rows); "
+                       "the anomaly-rate slider applies only when fitting fresh.")
+        if sample_btn:
+            log_changed("sample_loaded", {"rows": len(df_scored)})
+        elif st.checkbox("Add to supplier risk history", value=True, key="add_to_history"):
+            # One batch per file content: rescoring the same file replaces its earlier contribution
+            if st.session_state.get("history_merged") != key:
+                res = merge_batch(df_scored, batch_id=key.split("-")[0])
+                st.session_state["history_merged"] = key
+                log("risk_history_merged", res)
 
         # KPI cards
         anomalies = int(df_scored["is_anomaly"].sum())
@@ -331,33 +441,65 @@ with tab2:
             high_amt = (df_scored["amount"] > df_scored["amount"].median()*1.8).sum()
             st.markdown(f"""<div class="kpi-card"><div class="kpi-title">Very High Amount</div><div class="kpi-value">{int(high_amt)}</div></div>""", unsafe_allow_html=True)
 
+        mem = df_scored.attrs.get("memory")
+        if mem:
+            st.caption(f"In memory: {mem['after']['bytes'] / 2**20:.1f} MiB ({mem['after']['bytes_per_row']:.0f} bytes/row, "
+                       f"{mem['before']['bytes_per_row']:.0f} before compaction).")
+        # The cached frame is shared by every session; the sorted view below is only for display
+        st.session_state["scored_df"] = df_scored
+
         # Order + explain reasons
         cols = ["invoice_id","date","supplier","item","quantity","unit_price","lead_time_days","amount","anomaly_score","is_anomaly","reason_top_features"]
-        df_scored = df_scored[cols].sort_values(["is_anomaly","anomaly_score"], ascending=[False, False])
-
-        # Interactive table with filters (AgGrid)
-        gb = GridOptionsBuilder.from_dataframe(df_scored)
-        gb.configure_pagination(paginationAutoPageSize=True)
-        gb.configure_side_bar()
-        gb.configure_default_column(filter=True, sortable=True, resizable=True)
+        cols += ["model_segment"] if "model_segment" in df_scored.columns else []
+        default_order = row_order(df_scored, ["is_anomaly","anomaly_score"], [False, False], key=key)
+
+        # Server-side paging: filter / sort the full frame here and send only the visible page to the grid
+        f1, f2, f3, f4, f5 = st.columns([3,2,1,1,1])
+        with f1:
+            grid_text = st.text_input("Filter", placeholder="invoice, supplier, item or reason", key="inv_filter")
+        with f2:
+            sort_col = st.selectbox("Sort by", cols, index=cols.index("anomaly_score"), key="inv_sort")
+        with f3:
+            sort_desc = st.toggle("Descending", value=True, key="inv_desc")
+        with f4:
+            only_anomalies = st.toggle("Anomalies only", key="inv_only_anomalies")
+        with f5:
+            page_size = st.selectbox("Rows", PAGE_SIZES, index=1, key="inv_page_size")
+        order = row_order(df_scored, sort_col, not sort_desc, key=key,
+                          filters={"is_anomaly": True} if only_anomalies else None, text=grid_text.strip(),
+                          text_columns=["invoice_id","supplier","item","reason_top_features"])
+        page = page_picker("inv_page", len(order), page_size)
+        page_rows = widen_floats(df_scored.iloc[order[(page - 1) * page_size: page * page_size]][cols])
+
+        gb = GridOptionsBuilder.from_dataframe(page_rows)
+        gb.configure_default_column(resizable=True)
         grid_options = gb.build()
-        AgGrid(df_scored, gridOptions=grid_options, update_mode=GridUpdateMode.NO_UPDATE, theme="streamlit", height=360)
+        AgGrid(page_rows, gridOptions=grid_options, update_mode=GridUpdateMode.NO_UPDATE, theme="streamlit", height=360)
 
-        # Plotly score chart
-        fig = px.line(df_scored.reset_index(drop=True), y="anomaly_score", title="Anomaly Scores (higher = more anomalous)")
+        # Plotly score chart (the ordered scores, thinned to at most PLOT_POINTS points)
+        step = max(1, len(default_order) // PLOT_POINTS)
+        fig = px.line(x=list(range(0, len(default_order), step)), y=df_scored["anomaly_score"].to_numpy()[default_order[::step]],
+                      labels={"x": "rank", "y": "anomaly_score"}, title="Anomaly Scores (higher = more anomalous)")
         st.plotly_chart(fig, use_container_width=True)
 
-        # Downloads (CSV + Excel)
-        st.download_button("⬇️ Scored invoices (CSV)", df_scored.to_csv(index=False).encode("utf-8"), file_name="scored_invoices.csv", mime="text/csv")
-        bio = io.BytesIO()
-        with pd.ExcelWriter(bio, engine="openpyxl") as w:
-            df_scored.to_excel(w, index=False, sheet_name="Scored")
-        st.download_button("⬇️ Scored invoices (Excel)", bio.getvalue(),
-            file_name="scored_invoices.xlsx",
-            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-        )
-
-        st.session_state["scored_df"] = df_scored
+        # Downloads: serialized only when requested, then kept for this result (cache key)
+        e1, e2 = st.columns([1,2])
+        with e1:
+            export_fmt = st.radio("Export format", list(EXPORT_FORMATS), horizontal=True, key="export_fmt")
+        with e2:
+            export_id = (key, export_fmt)
+            if st.session_state.get("export_id") != export_id:
+                if st.button(f"Prepare {export_fmt} export"):
+                    kwargs = {"sheet_name": "Scored"} if export_fmt == "Excel" else {}
+                    with st.spinner(f"Writing {len(df_scored)} rows…"):
+                        st.session_state["export_data"] = export_bytes(widen_floats(df_scored.iloc[default_order][cols]), export_fmt, **kwargs)
+                    st.session_state["export_id"] = export_id
+            if st.session_state.get("export_id") == export_id:
+                _, ext, mime = EXPORT_FORMATS[export_fmt]
+                st.download_button(f"⬇️ Scored invoices ({export_fmt})", st.session_state["export_data"],
+                                   file_name=f"scored_invoices.{ext}", mime=mime)
+
+        st.session_state["scored_key"] = key
     else:
         st.info("Upload a CSV or use the sample to proceed.")
 
@@ -368,11 +510,28 @@ with tab3:
     if "scored_df" in st.session_state:
         scored = st.session_state["scored_df"]
     else:
-        scored = pd.read_csv(os.path.join("sample_data","sample_transactions.csv"))
-        scored = prepare_dataframe(scored)
-        scored, _ = fit_isolation_forest(scored, contamination=0.07)
-
-    agg = supplier_risk_table(scored)
+        scored = read_table(os.path.join("sample_data","sample_transactions.csv"))
+        saved_models = list_models()
+        if saved_models:
+            # Reuse the newest saved model instead of retraining on every rerun
+            scored = score_with_model(scored, load_model(saved_models[0]["name"], saved_models[0]["version"]), inplace=True)
+        else:
+            scored = prepare_dataframe(scored, copy=False)
+            scored, _ = fit_isolation_forest(scored, contamination=0.07, inplace=True)
+
+    first_day, last_day = history_range()
+    window_labels = {"Current data": "current"}
+    if last_day:
+        window_labels.update({f"Last {w} days": w for w in WINDOWS})
+        window_labels["All history"] = None
+    window = window_labels[st.radio("Window", list(window_labels), horizontal=True, key="risk_window")]
+
+    if window == "current":
+        agg = current_risk(scored, st.session_state.get("scored_key"))
+    else:
+        # Summed from the per-supplier daily aggregates; raw invoices are not re-read
+        agg = window_risk(window)
+        st.caption(f"History {first_day} → {last_day}; windows end at the latest stored day.")
     st.dataframe(agg, use_container_width=True, hide_index=True)
 
     fig2 = px.bar(agg, x="supplier", y="risk_score", title="Supplier Risk Score (0–100)")
@@ -381,15 +540,41 @@ with tab3:
     st.download_button("⬇️ Supplier risk (CSV)", agg.to_csv(index=False).encode("utf-8"),
                        file_name="supplier_risk.csv", mime="text/csv")
 
+    if last_day:
+        with st.expander("All windows side by side"):
+            st.dataframe(risk_windows(), use_container_width=True, hide_index=True)
+
 # ==================== TAB 4: EXPORT & AUDIT ====================
 with tab4:
     st.subheader("4) Export & Audit")
-    st.write("All actions are logged to `data/audit_log.csv` for transparency.")
-
-    log_path = os.path.join("data","audit_log.csv")
-    if os.path.exists(log_path):
-        df_log = pd.read_csv(log_path)
-        st.dataframe(df_log.tail(200), use_container_width=True, hide_index=True)
+    st.write("All actions are logged to `data/audit/audit.jsonl` (rotated by size/day) for transparency.")
+    import_legacy_csv()  # one-off: entries from the old data/audit_log.csv, no-op once imported
+
+    # Filters + paging run against the sidecar index; only the shown page is read from disk
+    f1, f2, f3 = st.columns([2,2,1])
+    with f1:
+        ev_filter = st.multiselect("Event types", event_types(), placeholder="All", key="audit_events")
+    with f2:
+        day_range = st.date_input("Date range (UTC)", value=(), key="audit_days")
+    with f3:
+        page_size = st.selectbox("Rows / page", [50, 200, 1000], index=1, key="audit_page_size")
+    start = end = None
+    if len(day_range) >= 1:
+        start = datetime.combine(day_range[0], datetime.min.time())
+        end = datetime.combine(day_range[-1], datetime.max.time())
+    # One pass returns the page and the match count; the page widget is drawn after it
+    page = st.session_state.get("audit_page", 1)
+    records, n_match = audit_query(start, end, ev_filter or None, page=page - 1, page_size=page_size)
+    n_pages = max(1, -(-n_match // page_size))
+    if page > n_pages:  # filters narrowed the result: show its last page
+        page = st.session_state["audit_page"] = n_pages
+        records, n_match = audit_query(start, end, ev_filter or None, page=page - 1, page_size=page_size)
+    st.number_input(f"Page (of {n_pages}, newest first)", 1, n_pages, step=1, key="audit_page")
+    if records:
+        df_log = pd.DataFrame(records)
+        df_log["details"] = df_log["details"].map(lambda d: json.dumps(d, ensure_ascii=False, default=str))
+        st.caption(f"{n_match} matching entries")
+        st.dataframe(df_log, use_container_width=True, hide_index=True)
     else:
         st.info("No audit entries yet. Run a few checks to populate the log.")
 
@@ -398,7 +583,7 @@ with tab4:
         total = len(scored)
         anomalies = int(scored["is_anomaly"].sum())
         anomaly_rate = f"{(anomalies/total*100 if total else 0):.1f}%"
-        agg = supplier_risk_table(scored)
+        agg = current_risk(scored, st.session_state.get("scored_key"))
         high_risk_suppliers = int((agg["risk_score"] >= 70).sum())
 
         summary = {
@@ -420,49 +605,122 @@ with tab4:
 # ==================== TAB 5: PRODUCT CATALOG (ADMIN) ====================
 with tab5:
     st.subheader("5) Product Catalog (Admin)")
-
-    df = load_db()
+    if "cat_flash" in st.session_state:
+        st.success(st.session_state.pop("cat_flash"))
+
+    # Server-side paging: SQLite returns one page, the grid edits it and only changed rows are saved
+    f1, f2, f3, f4 = st.columns([3,2,1,1])
+    with f1:
+        cat_text = st.text_input("Filter", placeholder="id, name, brand, model, SKU or GTIN", key="cat_filter")
+    with f2:
+        cat_sort = st.selectbox("Sort by", PRODUCT_COLUMNS, key="cat_sort")
+    with f3:
+        cat_desc = st.toggle("Descending", key="cat_desc")
+    with f4:
+        cat_page_size = st.selectbox("Rows", PAGE_SIZES, index=1, key="cat_page_size")
+    cat_total = count_products(text=cat_text.strip())
+    cat_page = page_picker("cat_page", cat_total, cat_page_size)
+    # The served page is kept in the session, so Save diffs against exactly what was shown
+    cat_view = (cat_page, cat_page_size, cat_sort, cat_desc, cat_text.strip(), st.session_state.get("cat_version", 0))
+    served = st.session_state.get("cat_served")
+    if served is None or served[0] != cat_view:
+        page_df, _ = query_products(cat_page, cat_page_size, cat_sort, not cat_desc, text=cat_text.strip())
+        page_df[ORIG_ID] = page_df["product_id"]
+        served = (cat_view, page_df)
+        st.session_state["cat_served"] = served
+    df = served[1]
+    new_rows = st.session_state.get("cat_new_rows", 0)
+    if new_rows:
+        df = pd.concat([df, pd.DataFrame([{**blank_row(), ORIG_ID: ""}] * new_rows)], ignore_index=True)
 
     # Editable grid (AgGrid)
     gb = GridOptionsBuilder.from_dataframe(df)
-    gb.configure_default_column(editable=True, filter=True, sortable=True, resizable=True)
-    gb.configure_pagination(paginationAutoPageSize=True)
-    gb.configure_side_bar()
+    gb.configure_default_column(editable=True, resizable=True)
+    gb.configure_column(ORIG_ID, hide=True, editable=False)
+    gb.configure_selection("multiple", use_checkbox=True)
     grid_options = gb.build()
 
     grid_resp = AgGrid(
         df,
         gridOptions=grid_options,
-        update_mode=GridUpdateMode.MODEL_CHANGED,
+        update_mode=GridUpdateMode.MODEL_CHANGED | GridUpdateMode.SELECTION_CHANGED,
         data_return_mode=DataReturnMode.AS_INPUT,
         fit_columns_on_grid_load=True,
         theme="streamlit",
-        height=420
+        height=420,
+        key="catalog_grid_" + "_".join(map(str, cat_view + (new_rows,))),
     )
     edited_df = pd.DataFrame(grid_resp["data"])
+    # Served ids: a product_id edited in the grid but not saved yet still names the stored row
+    selected_ids = [r.get(ORIG_ID) for r in (grid_resp.get("selected_rows") or []) if r.get(ORIG_ID)]
 
     c1, c2, c3, c4 = st.columns([1,1,1,2])
     with c1:
         if st.button("➕ Add row"):
-            edited_df = pd.concat([edited_df, pd.DataFrame([blank_row()])], ignore_index=True)
+            st.session_state["cat_new_rows"] = new_rows + 1
+            st.rerun()
     with c2:
         if st.button("💾 Save"):
-            save_db(edited_df)
-            st.success("Saved product database.")
+            try:
+                res = save_changes(served[1], edited_df)
+            except ValueError as e:
+                st.error(str(e))
+            else:
+                st.session_state["cat_new_rows"] = 0
+                st.session_state["cat_version"] = st.session_state.get("cat_version", 0) + 1
+                msg = f"Saved product database ({res['upserted']} row(s) updated, {res['deleted']} removed)."
+                if res["skipped"]:
+                    msg += f" {res['skipped']} row(s) without a product_id were not saved."
+                st.session_state["cat_flash"] = msg
+                st.rerun()
     with c3:
         tmpl = csv_template_path()
         with open(tmpl, "rb") as f:
             st.download_button("⬇️ CSV template", f, file_name="product_template.csv", mime="text/csv")
-
-    st.markdown("##### Bulk import (CSV/Excel)")
-    up = st.file_uploader("Upload CSV/Excel matching the template columns", type=["csv","xlsx"])
+    with c4:
+        if st.button(f"🗑️ Delete selected ({len(selected_ids)})", disabled=not selected_ids):
+            n = delete_products(selected_ids)
+            st.session_state["cat_version"] = st.session_state.get("cat_version", 0) + 1
+            st.session_state["cat_flash"] = f"Removed {n} product(s)."
+            st.rerun()
+
+    st.markdown("##### Bulk import (CSV/Excel/Parquet)")
+    up = st.file_uploader("Upload a file matching the template columns", type=["csv","xlsx","parquet","arrow","feather"])
     if up is not None:
         try:
             if up.name.lower().endswith(".xlsx"):
                 new_df = pd.read_excel(up)
             else:
-                new_df = pd.read_csv(up)
-            save_db(new_df)
-            st.success(f"Imported {len(new_df)} rows.")
+                new_df = read_table(up, dtypes=PRODUCT_DTYPES)
+            res = save_db(new_df)
+            msg = f"Imported {len(new_df) - res['skipped']} rows."
+            if res["skipped"]:
+                msg += f" {res['skipped']} row(s) without a product_id were not saved."
+            st.success(msg)
         except Exception as e:
             st.error(f"Failed to import: {e}")
+
+    st.markdown("##### Catalog image index")
+    st.caption(f"Images under `{CATALOG_DIR}` (including subfolders) are hashed into `{INDEX_PATH}`; "
+               "only new or changed files are re-hashed.")
+    i1, i2 = st.columns([1,3])
+    with i1:
+        index_workers = st.number_input("Worker processes", 1, os.cpu_count() or 1, os.cpu_count() or 1)
+    if st.button("🖼️ Update image index"):
+        bar = st.progress(0.0, text="Scanning catalog…")
+        last = [0.0]
+        def _index_progress(done, total, elapsed):
+            if done == total or time.monotonic() - last[0] >= 0.5:
+                last[0] = time.monotonic()
+                bar.progress(done / total, text=f"Hashed {done:,} / {total:,} · {done / elapsed:,.1f} images/s")
+        stats = index_catalog(CATALOG_DIR, workers=int(index_workers), progress=_index_progress)
+        bar.progress(1.0, text="Done")
+        st.session_state["catalog_index_stats"] = stats
+        log("catalog_indexed", {k: v for k, v in stats.items() if k != "failed"} | {"failed": len(stats["failed"])})
+    if "catalog_index_stats" in st.session_state:
+        stats = st.session_state["catalog_index_stats"]
+        st.success(f"{stats['indexed']:,} image(s) indexed · {stats['hashed']:,} hashed, {stats['removed']:,} removed "
+                   f"in {stats['seconds']}s ({stats['images_per_sec']} images/s)")
+        if stats["failed"]:
+            st.warning(f"{len(stats['failed'])} file(s) could not be read:")
+            st.dataframe(pd.DataFrame(stats["failed"], columns=["file", "error"]), use_container_width=True, hide_index=True)
@@ -0,0 +1,102 @@
+# benchmarks/bench_image_match.py
+"""
+Linear ImageHash scan vs BK-tree vs vectorized uint64 lookups on synthetic 64-bit pHashes,
+plus the cost of matching against every precomputed hash type x variant.
+
+    python -m benchmarks.bench_image_match --sizes 1000 10000 100000 --queries 200 --radius 12
+"""
+import argparse, random, time
+import imagehash
+import numpy as np
+
+from utils.hash_index import BKTree
+from utils.image_match import CatalogMatrix, HASH_FUNCS, VARIANTS, top_k_hash
+
+def _random_hashes(n: int, rng: random.Random):
+    return [rng.getrandbits(64) for _ in range(n)]
+
+def _near(h: int, bits: int, rng: random.Random) -> int:
+    for b in rng.sample(range(64), bits):
+        h ^= 1 << b
+    return h
+
+def _linear(query, catalog):
+    best, best_dist = None, 1e9
+    for entry in catalog:
+        d = query - entry["hash"]
+        if d < best_dist:
+            best_dist, best = d, entry
+    return best, best_dist
+
+def run(size: int, n_queries: int, radius: int, seed: int = 0):
+    rng = random.Random(seed)
+    ints = _random_hashes(size, rng)
+    catalog = [{"file": f"{i}.jpg", "hash": imagehash.hex_to_hash(f"{h:016x}")} for i, h in enumerate(ints)]
+    # Realistic uploads: re-photographed catalog items a few bits away
+    q_ints = [_near(rng.choice(ints), rng.randint(0, 8), rng) for _ in range(n_queries)]
+    q_hashes = [imagehash.hex_to_hash(f"{h:016x}") for h in q_ints]
+
+    t = time.perf_counter()
+    tree = BKTree((h, i) for i, h in enumerate(ints))
+    build_s = time.perf_counter() - t
+
+    t = time.perf_counter()
+    matrix = CatalogMatrix(catalog)
+    matrix_build_s = time.perf_counter() - t
+
+    t = time.perf_counter()
+    lin = [_linear(q, catalog)[1] for q in q_hashes]
+    linear_s = time.perf_counter() - t
+
+    t = time.perf_counter()
+    bk = [tree.nearest(q)[0] for q in q_ints]
+    nearest_s = time.perf_counter() - t
+
+    t = time.perf_counter()
+    for q in q_ints:
+        tree.within(q, radius)
+    within_s = time.perf_counter() - t
+
+    t = time.perf_counter()
+    vec = [top_k_hash(q, matrix, k=1)[0]["distance"] for q in q_ints]
+    matrix_s = time.perf_counter() - t
+
+    t = time.perf_counter()
+    for q in q_ints:
+        top_k_hash(q, matrix, k=5)
+    matrix_top5_s = time.perf_counter() - t
+
+    # Same catalog with random dHash / wHash columns and variants around each pHash
+    np_rng = np.random.default_rng(seed)
+    matrix.variants = np_rng.integers(0, 2**63, size=(len(HASH_FUNCS), len(VARIANTS), size), dtype=np.uint64)
+    matrix.variants[0, 0] = matrix.hashes
+    q_multi = [{t: (q if t == "phash" else rng.getrandbits(64)) for t in HASH_FUNCS} for q in q_ints]
+    t = time.perf_counter()
+    for q in q_multi:
+        top_k_hash(q, matrix, k=5)
+    variants_top5_s = time.perf_counter() - t
+
+    assert lin == bk == vec, "index lookups disagree with linear scan"
+    return {
+        "size": size,
+        "bktree_build_s": round(build_s, 3),
+        "matrix_build_s": round(matrix_build_s, 3),
+        "linear_ms_per_query": round(1000 * linear_s / n_queries, 3),
+        "bktree_nearest_ms_per_query": round(1000 * nearest_s / n_queries, 3),
+        f"bktree_within{radius}_ms_per_query": round(1000 * within_s / n_queries, 3),
+        "matrix_best_ms_per_query": round(1000 * matrix_s / n_queries, 3),
+        "matrix_top5_ms_per_query": round(1000 * matrix_top5_s / n_queries, 3),
+        f"variants{len(HASH_FUNCS) * len(VARIANTS)}_top5_ms_per_query": round(1000 * variants_top5_s / n_queries, 3),
+    }
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--radius", type=int, default=12)
+    args = ap.parse_args(argv)
+    for size in args.sizes:
+        print(run(size, args.queries, args.radius))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+# benchmarks/generators.py
+"""
+Deterministic synthetic data for the benchmarks: catalog hashes, product
+tables, invoices and serial lists at any size.
+"""
+import numpy as np
+import pandas as pd
+
+from utils.image_match import HASH_FUNCS, VARIANTS
+from utils.product_db import COLUMNS
+from utils.serial_check import luhn_like_many
+
+BRANDS = ["Apple", "Samsung", "Nike", "Adidas", "Sony", "Louis Vuitton", "Dyson", "Canon", "Bose", "Garmin"]
+CATEGORIES = ["Electronics", "Smartphone", "Shoes", "Bags", "Audio", "Cameras", "Wearables"]
+WORDS = ["Pro", "Max", "Air", "Ultra", "Mini", "Plus", "Lite", "Zoom", "Boost", "Wave", "Neo", "Edge", "One", "X"]
+SUPPLIERS = ["AlphaCo", "BetaWorks", "GammaLtd", "DeltaParts", "EpsilonInc"]
+
+def catalog_hash_entries(n: int, seed: int = 0, variants: bool = True) -> list:
+    """[{"file", "hash", "variants"}] as load_catalog_hashes() returns them, with random 64-bit hashes."""
+    rng = np.random.default_rng(seed)
+    shape = (n, len(HASH_FUNCS), len(VARIANTS))
+    raw = rng.integers(0, 2**63, size=shape, dtype=np.uint64) | rng.integers(0, 2, size=shape, dtype=np.uint64) << np.uint64(63)
+    entries = []
+    for i in range(n):
+        hexes = {t: [f"{int(h):016x}" for h in raw[i, j]] for j, t in enumerate(HASH_FUNCS)}
+        entries.append({"file": f"P{i:07d}_1.jpg", "hash": hexes["phash"][0],
+                        "variants": hexes if variants else None})
+    return entries
+
+def near_queries(entries: list, n: int, max_bits: int = 8, seed: int = 1) -> list:
+    """query_hashes()-style dicts: catalog hashes with a few bits flipped (re-photographed items)."""
+    rng = np.random.default_rng(seed)
+    out = []
+    for i in rng.integers(0, len(entries), n):
+        src = entries[i]["variants"] or {"phash": [entries[i]["hash"]]}
+        q = {}
+        for t in HASH_FUNCS:
+            h = int(src.get(t, src["phash"])[0], 16)
+            for b in rng.choice(64, rng.integers(0, max_bits + 1), replace=False):
+                h ^= 1 << int(b)
+            q[t] = f"{h:016x}"
+        out.append(q)
+    return out
+
+def product_table(n: int, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    brand = rng.choice(BRANDS, n)
+    prefix = np.array([b[:3].upper() for b in brand])
+    w1, w2 = rng.choice(WORDS, n), rng.choice(WORDS, n)
+    df = pd.DataFrame({
+        "product_id": [f"{p}-{i:07d}" for i, p in enumerate(prefix)],
+        "brand": brand,
+        "product_name": [f"{b} {a} {c} {i % 97}" for i, (b, a, c) in enumerate(zip(brand, w1, w2))],
+        "model": [f"M{x:06X}" for x in rng.integers(0, 16**6, n)],
+        "category": rng.choice(CATEGORIES, n),
+        "sku": [f"SKU-{x:08d}" for x in rng.integers(0, 10**8, n)],
+        "gtin": [f"{x:013d}" for x in rng.integers(10**11, 10**13, n)],
+        "msrp": rng.lognormal(5, 0.8, n).round(2),
+        "serial_prefix": prefix,
+        "image": "",
+        "notes": "",
+    })
+    return df[COLUMNS]
+
+def invoices(n: int, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    qty = rng.integers(1, 60, n)
+    price = rng.lognormal(4.5, 0.3, n).round(2)
+    return pd.DataFrame({
+        "invoice_id": [f"INV-{i:08d}" for i in range(n)],
+        "date": pd.Timestamp("2025-01-01") + pd.to_timedelta(rng.integers(0, 365, n), unit="D"),
+        "supplier": rng.choice(SUPPLIERS, n),
+        "item": rng.choice(["Widget-A", "Widget-B", "Widget-C", "Widget-D"], n),
+        "quantity": qty,
+        "unit_price": price,
+        "lead_time_days": rng.integers(1, 20, n),
+        "amount": (qty * price * rng.normal(1.0, 0.05, n)).round(2),
+    })
+
+def write_invoice_csv(path: str, n: int, seed: int = 0, chunk: int = 500_000) -> str:
+    """Invoice CSV of n rows, generated in chunks so large files don't need n rows in memory."""
+    for start in range(0, n, chunk):
+        part = invoices(min(chunk, n - start), seed + start)
+        part["invoice_id"] = [f"INV-{i:08d}" for i in range(start, start + len(part))]
+        part.to_csv(path, mode="a" if start else "w", header=start == 0, index=False)
+    return path
+
+def serials(n: int, seed: int = 0, invalid_rate: float = 0.2) -> list:
+    """Serials in the BRD-YYYY-NNNNNN format; about invalid_rate of them fail the checksum or format."""
+    rng = np.random.default_rng(seed)
+    prefix = rng.choice([b[:3].upper() for b in BRANDS], n)
+    year = rng.integers(2019, 2027, n)
+    body = rng.integers(0, 100_000, n)
+    stub = np.array([f"{p}-{y}-{b:05d}0" for p, y, b in zip(prefix, year, body)])
+    check = (10 - luhn_like_many(stub)) % 10   # last digit is not doubled, so it adds straight to the sum
+    out = np.array([s[:-1] + str(c) for s, c in zip(stub, check)], dtype=object)
+    bad = rng.random(n) < invalid_rate
+    out[bad] = [s[:-1] + str((int(s[-1]) + 1) % 10) if k else s.lower() + "X"
+                for s, k in zip(out[bad], rng.random(int(bad.sum())) < 0.5)]
+    return out.tolist()
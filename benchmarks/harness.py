@@ -0,0 +1,86 @@
+# benchmarks/harness.py
+"""
+Timing + peak-memory measurement and result files for the benchmark suite.
+
+Wall time is the best of `repeat` runs; peak memory comes from one extra run
+under tracemalloc (numpy and pandas report their buffers to it), kept separate
+because tracing slows pure-Python code down.
+"""
+import gc, json, os, platform, subprocess, sys, time, tracemalloc
+from datetime import datetime, timezone
+
+def measure(fn, repeat: int = 3, items: int | None = None) -> dict:
+    """{"best_s", "median_s", "runs", "peak_mib"[, "items", "items_per_s"]} for fn()."""
+    times = []
+    for _ in range(repeat):
+        gc.collect()
+        t = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t)
+    gc.collect()
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    times.sort()
+    out = {"best_s": round(times[0], 6), "median_s": round(times[len(times) // 2], 6),
+           "runs": repeat, "peak_mib": round(peak / 2**20, 3)}
+    if items:
+        out["items"] = items
+        out["items_per_s"] = round(items / times[0], 1) if times[0] > 0 else None
+    return out
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, timeout=10, check=True).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+def environment() -> dict:
+    import numpy, pandas, sklearn
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "git_commit": git_commit(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "numpy": numpy.__version__,
+        "pandas": pandas.__version__,
+        "sklearn": sklearn.__version__,
+    }
+
+def write_results(path: str, results: list) -> str:
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"meta": environment(), "results": results}, f, indent=2)
+    return path
+
+def load_results(path: str) -> dict:
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+def compare(old: dict, new: dict, threshold: float = 0.10, min_mem_mib: float = 1.0) -> list:
+    """
+    Rows matched on (suite, case, size) with new/old ratios for best time and peak memory.
+    "regression" is set when either ratio exceeds 1 + threshold (memory only when it
+    also grew by more than min_mem_mib, so tiny allocations don't flag noise).
+    """
+    before = {(r["suite"], r["case"], r["size"]): r for r in old["results"]}
+    rows = []
+    for r in new["results"]:
+        o = before.get((r["suite"], r["case"], r["size"]))
+        if o is None:
+            continue
+        t_ratio = r["best_s"] / o["best_s"] if o["best_s"] else None
+        m_ratio = r["peak_mib"] / o["peak_mib"] if o["peak_mib"] else None
+        rows.append({"suite": r["suite"], "case": r["case"], "size": r["size"],
+                     "old_s": o["best_s"], "new_s": r["best_s"],
+                     "time_ratio": round(t_ratio, 3) if t_ratio else None,
+                     "mem_ratio": round(m_ratio, 3) if m_ratio else None,
+                     "regression": bool((t_ratio or 0) > 1 + threshold
+                                        or ((m_ratio or 0) > 1 + threshold and r["peak_mib"] - o["peak_mib"] > min_mem_mib))})
+    return rows
@@ -0,0 +1,134 @@
+# benchmarks/run_suite.py
+"""
+Benchmark suite for the hot paths: image matching, product search, anomaly
+scoring / supplier risk and serial validation, each at several sizes.
+
+    python -m benchmarks.run_suite --preset small                 # quick check
+    python -m benchmarks.run_suite --preset medium --suites image search
+    python -m benchmarks.run_suite compare old.json new.json      # exit 1 on regressions
+
+Results (best / median seconds, items/s, peak MiB, environment) are written as
+JSON to benchmarks/results/ unless --out is given.
+"""
+import argparse, os, sys, tempfile
+
+import numpy as np
+
+from benchmarks import generators as gen
+from benchmarks.harness import measure, write_results, load_results, compare, git_commit
+from utils import product_db
+from utils.anomaly import prepare_dataframe, fit_isolation_forest, supplier_risk_table
+from utils.batch_scan import match_hashes
+from utils.ingest import compact_frame
+from utils.image_match import HASH_FUNCS, CatalogMatrix, top_k_hash
+from utils.search_index import SearchIndex
+from utils.serial_check import validate_serial, validate_serials, AllowList
+
+PRESETS = {
+    "small":  {"image": [1_000, 10_000],    "search": [1_000, 10_000],    "anomaly": [10_000, 50_000],      "serial": [10_000, 100_000]},
+    "medium": {"image": [10_000, 100_000],  "search": [10_000, 100_000],  "anomaly": [100_000, 500_000],    "serial": [100_000, 1_000_000]},
+    "large":  {"image": [100_000, 500_000], "search": [100_000, 500_000], "anomaly": [1_000_000, 2_000_000], "serial": [1_000_000, 5_000_000]},
+}
+QUERIES = 50
+
+def bench_image(size: int, repeat: int) -> list:
+    entries = gen.catalog_hash_entries(size)
+    queries = gen.near_queries(entries, QUERIES)
+    matrix = CatalogMatrix(entries)
+    q_batch = np.array([[int(q[t], 16) for t in HASH_FUNCS] for q in queries], dtype=np.uint64)
+    return [
+        ("matrix_build", measure(lambda: CatalogMatrix(entries), repeat=1, items=size)),
+        ("best_match_phash", measure(lambda: [top_k_hash(int(q["phash"], 16), matrix, k=1) for q in queries],
+                                     repeat, items=QUERIES)),
+        ("top5_all_variants", measure(lambda: [top_k_hash(q, matrix, k=5) for q in queries], repeat, items=QUERIES)),
+        ("batch_match_all_variants", measure(lambda: match_hashes(q_batch, matrix), repeat, items=QUERIES)),
+    ]
+
+def bench_search(size: int, repeat: int) -> list:
+    df = gen.product_table(size)
+    names = df["product_name"].sample(QUERIES, random_state=0).str.lower().str[:-3].tolist()
+    gtins = df["gtin"].sample(QUERIES, random_state=1).tolist()
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)  # product_db keeps its SQLite file under ./data
+        try:
+            product_db.init_db(seed=df)  # exactly `size` rows, no starter rows
+            assert product_db.count_products() == size
+            out = [
+                ("index_build", measure(lambda: SearchIndex(product_db.load_db()), repeat=1, items=size)),
+                ("search_products_fuzzy", measure(lambda: [product_db.search_products(q) for q in names],
+                                                  repeat, items=QUERIES)),
+                ("search_products_facet", measure(lambda: [product_db.search_products(q, brands=["Apple", "Sony"])
+                                                           for q in names], repeat, items=QUERIES)),
+                ("lookup_gtin", measure(lambda: [product_db.products_by_gtin(g) for g in gtins], repeat, items=QUERIES)),
+            ]
+        finally:
+            product_db.clear_cache()
+            os.chdir(cwd)
+    return out
+
+def bench_anomaly(size: int, repeat: int) -> list:
+    raw = gen.invoices(size)
+    df = prepare_dataframe(raw)
+    scored, _ = fit_isolation_forest(df)
+    compact = compact_frame(scored.copy())
+    return [
+        ("prepare_dataframe", measure(lambda: prepare_dataframe(raw), repeat, items=size)),
+        ("fit_isolation_forest", measure(lambda: fit_isolation_forest(df), repeat=1, items=size)),
+        ("supplier_risk_table", measure(lambda: supplier_risk_table(scored), repeat, items=size)),
+        ("compact_frame", measure(lambda: compact_frame(scored.copy()), repeat, items=size)),
+        ("supplier_risk_table_compact", measure(lambda: supplier_risk_table(compact), repeat, items=size)),
+    ]
+
+def bench_serial(size: int, repeat: int) -> list:
+    values = gen.serials(size)
+    allow = AllowList(values[: size // 2])
+    loop_n = min(size, 100_000)  # the per-row loop is timed on a capped slice
+    return [
+        ("validate_serial_loop", measure(lambda: [validate_serial(s) for s in values[:loop_n]], repeat=1, items=loop_n)),
+        ("validate_serials_bulk", measure(lambda: validate_serials(values), repeat, items=size)),
+        ("validate_serials_allowlist", measure(lambda: validate_serials(values, allowlist=allow), repeat, items=size)),
+    ]
+
+SUITES = {"image": bench_image, "search": bench_search, "anomaly": bench_anomaly, "serial": bench_serial}
+
+def run(preset: str = "small", suites=None, repeat: int = 3, log=print) -> list:
+    results = []
+    for suite in suites or SUITES:
+        for size in PRESETS[preset][suite]:
+            for case, stats in SUITES[suite](size, repeat):
+                row = {"suite": suite, "case": case, "size": size, **stats}
+                results.append(row)
+                log(f"{suite:8s} {case:28s} {size:>10,}  best {row['best_s']:.4f}s  "
+                    f"peak {row['peak_mib']:.1f} MiB" + (f"  {row['items_per_s']:,.0f}/s" if row.get("items_per_s") else ""))
+    return results
+
+def _cmd_compare(argv) -> int:
+    ap = argparse.ArgumentParser(prog="python -m benchmarks.run_suite compare")
+    ap.add_argument("old")
+    ap.add_argument("new")
+    ap.add_argument("--threshold", type=float, default=0.10, help="allowed slowdown / memory growth (0.10 = 10%%)")
+    args = ap.parse_args(argv)
+    rows = compare(load_results(args.old), load_results(args.new), args.threshold)
+    for r in rows:
+        flag = "REGRESSION" if r["regression"] else ""
+        print(f"{r['suite']:8s} {r['case']:28s} {r['size']:>10,}  time x{r['time_ratio']}  mem x{r['mem_ratio']}  {flag}")
+    return 1 if any(r["regression"] for r in rows) else 0
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv[:1] == ["compare"]:
+        return _cmd_compare(argv[1:])
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--preset", choices=list(PRESETS), default="small")
+    ap.add_argument("--suites", nargs="+", choices=list(SUITES), default=list(SUITES))
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--out", help="results JSON (default: benchmarks/results/<commit>-<preset>.json)")
+    args = ap.parse_args(argv)
+    results = run(args.preset, args.suites, args.repeat)
+    out = args.out or os.path.join("benchmarks", "results", f"{git_commit() or 'local'}-{args.preset}.json")
+    print(f"results -> {write_results(out, results)}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
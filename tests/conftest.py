@@ -0,0 +1,5 @@
+# tests/conftest.py
+import os, sys
+
+# utils/ and benchmarks/ are imported from the repository root, as `python -m utils.cli` does
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
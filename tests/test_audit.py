@@ -0,0 +1,42 @@
+# tests/test_audit.py
+"""Audit log queries: one-pass counts, cached indexes and files rotated away mid-query."""
+
+import pytest
+
+from utils import audit
+
+@pytest.fixture
+def writer(tmp_path, monkeypatch):
+    w = audit.AuditWriter(log_dir=str(tmp_path), max_bytes=4096, batch_size=10)
+    monkeypatch.setattr(audit, "_WRITER", w)
+    for i in range(200):
+        audit.log("even" if i % 2 == 0 else "odd", {"i": i})
+    audit.flush()
+    assert len(audit.rotated_files(w.log_dir)) > 1
+    return w
+
+def test_query_pages_and_counts(writer):
+    records, total = audit.query(page=0, page_size=30)
+    assert total == 200 and len(records) == 30
+    assert records[0]["details"]["i"] == 199
+    records, total = audit.query(events=["odd"], page=3, page_size=30)
+    assert total == 100 and [r["details"]["i"] for r in records][:2] == [19, 17]
+    assert audit.event_types() == ["even", "odd"]
+
+def test_rotated_indexes_are_cached(writer, monkeypatch):
+    audit.query()
+    loads = []
+    real = audit._load_index
+    monkeypatch.setattr(audit, "_load_index", lambda p: loads.append(p) or real(p))
+    audit.query()
+    audit.event_types()
+    assert loads == []
+
+def test_file_rotated_mid_query_is_retried(writer, monkeypatch):
+    real = audit._read_lines
+    def rotate_first(path, offsets):
+        monkeypatch.setattr(audit, "_read_lines", real)
+        raise FileNotFoundError(path)
+    monkeypatch.setattr(audit, "_read_lines", rotate_first)
+    records, total = audit.query(page_size=10)
+    assert total == 200 and len(records) == 10
@@ -5,59 +5,114 @@ from sklearn.ensemble import IsolationForest
 
 NUMERIC_FEATURES = ["amount", "unit_price", "quantity", "lead_time_days"]
 
-def prepare_dataframe(df: pd.DataFrame) -> pd.DataFrame:
-    df = df.copy()
+def feature_medians(df: pd.DataFrame) -> dict:
+    """Imputation values for NUMERIC_FEATURES (0.0 for all-missing columns)."""
+    out = {}
+    for col in NUMERIC_FEATURES:
+        vals = pd.to_numeric(df[col], errors="coerce") if col in df.columns else pd.Series(dtype=float)
+        med = vals.median()
+        out[col] = 0.0 if pd.isna(med) else float(med)
+    return out
+
+def prepare_dataframe(df: pd.DataFrame, medians: dict | None = None, copy: bool = True) -> pd.DataFrame:
+    """
+    Coerce NUMERIC_FEATURES and impute missing values. Pass `medians` (e.g. from
+    a reference window) to impute consistently across chunks / uploads.
+    copy=False modifies `df` itself (for frames the caller owns).
+    """
+    if copy:
+        df = df.copy()
     for col in NUMERIC_FEATURES:
         if col in df.columns:
             df[col] = pd.to_numeric(df[col], errors="coerce")
         else:
             df[col] = np.nan
+    if medians is None:
+        medians = feature_medians(df)
     for col in NUMERIC_FEATURES:
-        if df[col].isna().all():
-            df[col] = 0.0
-        else:
-            df[col] = df[col].fillna(df[col].median())
+        df[col] = df[col].fillna(medians[col])
     for col in ["invoice_id","supplier","item","date"]:
         if col not in df.columns:
             df[col] = ""
     return df
 
-def _zscore_cols(df: pd.DataFrame, cols):
+def zscore_stats(df: pd.DataFrame, cols=NUMERIC_FEATURES) -> dict:
+    return {c: (float(np.nanmean(df[c].values)), float(np.nanstd(df[c].values) + 1e-9)) for c in cols}
+
+def zscore_frame(df: pd.DataFrame, cols, stats: dict | None = None) -> pd.DataFrame:
+    """Per-column z-scores of df[cols], against `stats` (zscore_stats() output) or the frame's own."""
+    stats = stats or zscore_stats(df, cols)
     out = {}
     for c in cols:
-        mu = np.nanmean(df[c].values)
-        sd = np.nanstd(df[c].values) + 1e-9
+        mu, sd = stats[c]
         out[c] = (df[c].values - mu) / sd
     return pd.DataFrame(out, index=df.index)
 
-def fit_isolation_forest(df: pd.DataFrame, contamination: float = 0.07, random_state: int = 42):
+def fit_isolation_forest(df: pd.DataFrame, contamination: float = 0.07, random_state: int = 42, inplace: bool = False):
     X = df[NUMERIC_FEATURES].values
     clf = IsolationForest(contamination=contamination, random_state=random_state)
     clf.fit(X)
+    return score_isolation_forest(df, clf, inplace=inplace), clf
+
+def score_isolation_forest(df: pd.DataFrame, clf: IsolationForest, zstats: dict | None = None,
+                           inplace: bool = False) -> pd.DataFrame:
+    """
+    Score a prepared frame with an already-fitted forest. `zstats` fixes the
+    mean/std used for reasons (defaults to the frame's own), so chunks of one
+    file are explained against the same baseline. inplace=True adds the score
+    columns to `df` instead of a copy.
+    """
+    X = df[NUMERIC_FEATURES].values
     scores = -clf.score_samples(X)  # higher = more anomalous
     preds = clf.predict(X)          # -1 = anomaly, 1 = normal
 
-    df_out = df.copy()
+    df_out = df if inplace else df.copy()
     df_out["anomaly_score"] = scores
     df_out["is_anomaly"] = (preds == -1)
 
     # Human-readable reasons (top-2 deviating features by |z|)
-    z = _zscore_cols(df_out, NUMERIC_FEATURES).abs()
-    reasons = []
-    for i in range(len(df_out)):
-        row = z.iloc[i]
-        order = list(row.sort_values(ascending=False).index[:2])
-        txt = ", ".join([f"{f} z≈{row[f]:.1f}" for f in order])
-        reasons.append(txt)
-    df_out["reason_top_features"] = reasons
-    return df_out, clf
+    df_out["reason_top_features"] = top_feature_reasons(zscore_frame(df_out, NUMERIC_FEATURES, zstats).abs())
+    return df_out
 
-def supplier_risk_table(scored: pd.DataFrame) -> pd.DataFrame:
-    agg = scored.groupby("supplier").agg(
+def top_feature_reasons(z: pd.DataFrame, k: int = 2) -> list:
+    """'feat z≈1.2, feat z≈0.8' per row from an |z| frame, via one argsort over the whole matrix."""
+    zv = z.to_numpy(dtype=float)
+    if len(zv) == 0:
+        return []
+    k = min(k, zv.shape[1])
+    # Stable descending sort: exact ties keep column order, NaN sorts last
+    order = np.argsort(-zv, axis=1, kind="stable")[:, :k]
+    names = np.asarray(z.columns, dtype=object)[order]
+    vals = np.take_along_axis(zv, order, axis=1)
+    parts = [[f"{n} z≈{v:.1f}" for n, v in zip(names[:, j], vals[:, j])] for j in range(k)]
+    return [", ".join(p) for p in zip(*parts)]
+
+def supplier_partials(scored: pd.DataFrame) -> pd.DataFrame:
+    """Additive per-supplier sums; partials from several chunks can be concatenated and re-summed."""
+    return scored.groupby("supplier", observed=True).agg(
         total=("invoice_id","count"),
         anomalies=("is_anomaly","sum"),
-        avg_score=("anomaly_score","mean")
+        score_sum=("anomaly_score","sum"),
+        score_n=("anomaly_score","count")
     ).reset_index()
+
+def supplier_daily_partials(scored: pd.DataFrame) -> pd.DataFrame:
+    """supplier_partials() per invoice day ("YYYY-MM-DD"); rows without a parseable date are left out."""
+    day = pd.to_datetime(scored["date"], errors="coerce").dt.strftime("%Y-%m-%d")
+    dated = scored.assign(day=day)[day.notna()]
+    return dated.groupby(["supplier", "day"], observed=True).agg(
+        total=("invoice_id","count"),
+        anomalies=("is_anomaly","sum"),
+        score_sum=("anomaly_score","sum"),
+        score_n=("anomaly_score","count")
+    ).reset_index()
+
+def merge_partials(*partials: pd.DataFrame) -> pd.DataFrame:
+    return pd.concat(partials, ignore_index=True).groupby("supplier", as_index=False, observed=True).sum()
+
+def risk_from_partials(partials: pd.DataFrame) -> pd.DataFrame:
+    agg = partials[["supplier","total","anomalies"]].copy()
+    agg["avg_score"] = partials["score_sum"] / partials["score_n"].where(partials["score_n"] > 0)
     if len(agg) == 0:
         agg["risk_score"] = 0.0
         return agg
@@ -65,3 +120,6 @@ def supplier_risk_table(scored: pd.DataFrame) -> pd.DataFrame:
     norm = (agg["avg_score"] - agg["avg_score"].min()) / (agg["avg_score"].max() - agg["avg_score"].min() + 1e-9)
     agg["risk_score"] = ((0.6 * rate + 0.4 * norm) * 100).round(1)
     return agg.sort_values("risk_score", ascending=False)
+
+def supplier_risk_table(scored: pd.DataFrame) -> pd.DataFrame:
+    return risk_from_partials(supplier_partials(scored))
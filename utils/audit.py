@@ -1,14 +1,380 @@
 # utils/audit.py
-from datetime import datetime
-import csv, os
+"""
+Audit log: JSON lines written by a background thread.
 
-LOG_PATH = os.path.join("data", "audit_log.csv")
+log() only enqueues; a daemon writer drains the bounded queue in batches, so
+a rerun costs no file I/O. Appends and rotations hold an exclusive file lock,
+so several sessions / processes can share data/audit safely. The active file
+is rotated to audit-<date>-<n>.jsonl when it grows past MAX_BYTES or the
+day changes.
+
+Every .jsonl file has a sidecar .idx of fixed-size (ts, byte offset, event)
+records, so tail reads and time-range / event queries only touch the index
+plus the lines actually returned. Loaded indexes (and their event names) are
+cached per process by file size + mtime, so reruns re-read only the active
+file's index, and only after it changed.
+
+Entries from the legacy data/audit_log.csv are imported once into a rotated
+file (import_legacy_csv); a marker file in the log directory records it.
+Timestamps and rotation days are UTC throughout.
+"""
+from datetime import datetime, timezone
+import os, ast, csv, json, queue, threading, atexit, glob
+from contextlib import contextmanager
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: rely on the in-process lock only
+    fcntl = None
+
+LOG_DIR = os.path.join("data", "audit")
+ACTIVE_NAME = "audit.jsonl"
+LEGACY_CSV = os.path.join("data", "audit_log.csv")
+LEGACY_MARKER = ".legacy_imported"
+MAX_BYTES = 20 * 1024 * 1024
+MAX_FILES = 60
+QUEUE_SIZE = 10_000
+BATCH_SIZE = 500
+FLUSH_INTERVAL = 0.5  # seconds
+
+# Sidecar index record: epoch seconds, byte offset of the line, event name
+INDEX_DTYPE = np.dtype([("ts", "<f8"), ("offset", "<u8"), ("event", "S40")])
+
+def _index_path(path: str) -> str:
+    return path[:-len(".jsonl")] + ".idx"
+
+def _epoch(ts_iso: str) -> float:
+    return datetime.fromisoformat(ts_iso).replace(tzinfo=timezone.utc).timestamp()
+
+def _utc_day(epoch: float):
+    return datetime.fromtimestamp(epoch, timezone.utc).date()
+
+def _index_records(records: list, base_offset: int, lines: list) -> bytes:
+    idx = np.zeros(len(records), dtype=INDEX_DTYPE)
+    offsets = np.cumsum([0] + [len(l) for l in lines[:-1]], dtype=np.uint64) + np.uint64(base_offset)
+    idx["offset"] = offsets
+    idx["ts"] = [_epoch(r["ts_iso"]) for r in records]
+    idx["event"] = [str(r.get("event", "")).encode("utf-8")[:40] for r in records]
+    return idx.tobytes()
+
+@contextmanager
+def _dir_lock(log_dir: str, exclusive: bool):
+    """flock on <log_dir>/.lock: exclusive for appends / rotation / index rebuilds, shared for index checks."""
+    with open(os.path.join(log_dir, ".lock"), "a") as lockf:
+        if fcntl:
+            fcntl.flock(lockf, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(lockf, fcntl.LOCK_UN)
+
+class AuditWriter:
+    def __init__(self, log_dir: str = LOG_DIR, max_bytes: int = MAX_BYTES, max_files: int = MAX_FILES,
+                 queue_size: int = QUEUE_SIZE, batch_size: int = BATCH_SIZE, flush_interval: float = FLUSH_INTERVAL):
+        self.log_dir = log_dir
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.dropped = 0
+        self._q = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()     # guards thread start
+        self._io_lock = threading.Lock()  # serializes appends / rotation in this process
+        self._thread = None
+
+    @property
+    def active_path(self) -> str:
+        return os.path.join(self.log_dir, ACTIVE_NAME)
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+                    self._thread.start()
+
+    def submit(self, record: dict):
+        self._ensure_thread()
+        try:
+            self._q.put(record, timeout=1.0)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        while True:
+            batch = [self._q.get()]
+            try:
+                while len(batch) < self.batch_size:
+                    batch.append(self._q.get(timeout=self.flush_interval))
+            except queue.Empty:
+                pass
+            try:
+                self._write(batch)
+            except Exception:
+                self.dropped += len(batch)
+            finally:
+                for _ in batch:
+                    self._q.task_done()
+
+    def _write(self, batch: list):
+        os.makedirs(self.log_dir, exist_ok=True)
+        lines = [(json.dumps(r, ensure_ascii=False, default=str) + "\n").encode("utf-8") for r in batch]
+        payload = b"".join(lines)
+        with self._io_lock, _dir_lock(self.log_dir, exclusive=True):
+            self._maybe_rotate(len(payload))
+            with open(self.active_path, "ab") as f:
+                base = f.tell()
+                f.write(payload)
+            with open(_index_path(self.active_path), "ab") as f:
+                f.write(_index_records(batch, base, lines))
+
+    def _maybe_rotate(self, incoming: int):
+        try:
+            st = os.stat(self.active_path)
+        except FileNotFoundError:
+            return
+        # Named by the UTC day of its last write, the same clock as the records' ts_iso
+        day = _utc_day(st.st_mtime)
+        if st.st_size + incoming <= self.max_bytes and day == _utc_day(datetime.now(timezone.utc).timestamp()):
+            return
+        n = 1
+        while True:
+            target = os.path.join(self.log_dir, f"audit-{day.isoformat()}-{n}.jsonl")
+            if not os.path.exists(target):
+                break
+            n += 1
+        os.replace(self.active_path, target)
+        if os.path.exists(_index_path(self.active_path)):
+            os.replace(_index_path(self.active_path), _index_path(target))
+        rotated = sorted(rotated_files(self.log_dir), key=os.path.getmtime)
+        for old in rotated[:max(0, len(rotated) - self.max_files)]:
+            for p in (old, _index_path(old)):
+                try:
+                    os.remove(p)
+                except OSError:
+                    pass
+
+    def flush(self):
+        """Block until everything queued so far is on disk."""
+        if self._thread is not None and self._thread.is_alive():
+            self._q.join()
+
+def rotated_files(log_dir: str = LOG_DIR) -> list:
+    return glob.glob(os.path.join(log_dir, "audit-*.jsonl"))
+
+_WRITER = AuditWriter()
+atexit.register(_WRITER.flush)
 
 def log(event: str, details: dict | None = None):
-    os.makedirs("data", exist_ok=True)
-    exists = os.path.exists(LOG_PATH)
-    with open(LOG_PATH, "a", newline="", encoding="utf-8") as f:
-        w = csv.writer(f)
-        if not exists:
-            w.writerow(["ts_iso", "event", "details"])
-        w.writerow([datetime.utcnow().isoformat(), event, (details or {})])
+    _WRITER.submit({"ts_iso": datetime.utcnow().isoformat(), "event": event, "details": details or {}})
+
+def flush():
+    _WRITER.flush()
+
+def _legacy_details(text: str):
+    # The CSV logger wrote str(dict); keep anything unparsable as the raw text
+    try:
+        value = ast.literal_eval(text) if text else {}
+    except (ValueError, SyntaxError):
+        return {"raw": text}
+    return value if isinstance(value, dict) else {"raw": text}
+
+def import_legacy_csv(csv_path: str = LEGACY_CSV, log_dir: str | None = None) -> int:
+    """
+    Copy the legacy CSV audit log (ts_iso, event, details) into a rotated
+    audit-<first day>-legacy.jsonl file with its index, once per log directory.
+    The file's mtime is set to its last entry so it sorts among the rotated files
+    by age. Returns the number of records imported (0 when done before or no CSV).
+    """
+    log_dir = log_dir or _WRITER.log_dir
+    marker = os.path.join(log_dir, LEGACY_MARKER)
+    if os.path.exists(marker) or not os.path.exists(csv_path):
+        return 0
+    os.makedirs(log_dir, exist_ok=True)
+    with _dir_lock(log_dir, exclusive=True):
+        if os.path.exists(marker):  # another process imported it meanwhile
+            return 0
+        records = []
+        with open(csv_path, newline="", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                try:
+                    _epoch(row.get("ts_iso") or "")
+                except ValueError:
+                    continue
+                records.append({"ts_iso": row["ts_iso"], "event": row.get("event") or "",
+                                "details": _legacy_details(row.get("details") or "")})
+        if records:
+            records.sort(key=lambda r: _epoch(r["ts_iso"]))
+            lines = [(json.dumps(r, ensure_ascii=False, default=str) + "\n").encode("utf-8") for r in records]
+            path = os.path.join(log_dir, f"audit-{records[0]['ts_iso'][:10]}-legacy.jsonl")
+            last = _epoch(records[-1]["ts_iso"])
+            for p, data in ((path, b"".join(lines)), (_index_path(path), _index_records(records, 0, lines))):
+                with open(p + ".tmp", "wb") as out:
+                    out.write(data)
+                os.replace(p + ".tmp", p)
+                os.utime(p, (last, last))
+        with open(marker, "w", encoding="utf-8") as f:
+            f.write(f"{csv_path}\t{len(records)}\n")
+    return len(records)
+
+def _fresh_index(path: str):
+    """The sidecar index if it covers the whole .jsonl file, else None."""
+    ipath = _index_path(path)
+    size = os.path.getsize(path)
+    if not os.path.exists(ipath):
+        return None
+    idx = np.fromfile(ipath, dtype=INDEX_DTYPE)
+    # Stale if the log grew without index records (e.g. a crash between the two appends)
+    if len(idx) == 0:
+        return idx if size == 0 else None
+    with open(path, "rb") as f:
+        f.seek(int(idx["offset"][-1]))
+        f.readline()
+        return idx if f.tell() >= size else None
+
+def _load_index(path: str) -> np.ndarray:
+    """
+    Sidecar index for a .jsonl file, (re)built by scanning it when missing or stale.
+    Checked under the writer's lock (shared) and rebuilt under it (exclusive), so a
+    rebuild never interleaves with an append of a line and its index record.
+    """
+    log_dir = os.path.dirname(path) or "."
+    try:
+        with _dir_lock(log_dir, exclusive=False):
+            idx = _fresh_index(path)
+        if idx is not None:
+            return idx
+        with _dir_lock(log_dir, exclusive=True):
+            idx = _fresh_index(path)  # another reader may have rebuilt it meanwhile
+            if idx is not None:
+                return idx
+            return _rebuild_index(path)
+    except FileNotFoundError:  # rotated away since the directory was listed
+        return np.zeros(0, dtype=INDEX_DTYPE)
+
+# path -> ((size, mtime_ns), index array, event names); rotated files never change, so they stay cached
+_INDEX_MEMO = {}
+_INDEX_MEMO_LOCK = threading.Lock()
+
+def _cached_index(path: str):
+    """(index, event names) for a .jsonl file, from the memo while its size and mtime are unchanged."""
+    try:
+        st = os.stat(path)  # before loading: an append racing the load only causes a reload next time
+    except FileNotFoundError:
+        return np.zeros(0, dtype=INDEX_DTYPE), frozenset()
+    sig = (st.st_size, st.st_mtime_ns)
+    with _INDEX_MEMO_LOCK:
+        hit = _INDEX_MEMO.get(path)
+    if hit is not None and hit[0] == sig:
+        return hit[1], hit[2]
+    idx = _load_index(path)
+    events = frozenset(e.decode("utf-8", "replace") for e in np.unique(idx["event"]))
+    with _INDEX_MEMO_LOCK:
+        _INDEX_MEMO[path] = (sig, idx, events)
+    return idx, events
+
+def _forget_missing(log_dir: str, paths: list):
+    """Drop memo entries of files in log_dir that were rotated away or pruned."""
+    keep = set(paths)
+    with _INDEX_MEMO_LOCK:
+        for p in [p for p in _INDEX_MEMO if os.path.dirname(p) == log_dir and p not in keep]:
+            del _INDEX_MEMO[p]
+
+def _rebuild_index(path: str) -> np.ndarray:
+    ipath = _index_path(path)
+    records, lines = [], []
+    with open(path, "rb") as f:
+        for line in f:
+            try:
+                rec = json.loads(line)
+                _epoch(rec["ts_iso"])
+            except (ValueError, KeyError, TypeError):
+                rec = {"ts_iso": "1970-01-01T00:00:00", "event": ""}
+            records.append(rec)
+            lines.append(line)
+    data = _index_records(records, 0, lines) if records else b""
+    tmp = ipath + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, ipath)
+    return np.frombuffer(data, dtype=INDEX_DTYPE)
+
+def _mtime(path: str) -> float:
+    try:
+        return os.path.getmtime(path)
+    except FileNotFoundError:  # rotated or pruned while listing
+        return 0.0
+
+def _log_files(log_dir: str) -> list:
+    """Newest first: the active file, then rotated files by mtime."""
+    files = sorted(rotated_files(log_dir), key=_mtime, reverse=True)
+    active = os.path.join(log_dir, ACTIVE_NAME)
+    out = ([active] if os.path.exists(active) else []) + files
+    _forget_missing(log_dir, out)
+    return out
+
+def _read_lines(path: str, offsets) -> list:
+    out = []
+    with open(path, "rb") as f:
+        for off in offsets:
+            f.seek(int(off))
+            try:
+                out.append(json.loads(f.readline()))
+            except ValueError:
+                continue
+    return out
+
+def query(start: datetime | None = None, end: datetime | None = None, events: list | None = None,
+          page: int = 0, page_size: int = 200, log_dir: str | None = None):
+    """
+    Newest-first page of audit records matching a UTC time range and event types.
+    Returns (records, total_matching), both from one pass over the (cached) indexes;
+    only the returned lines are read from the logs. If the active file is rotated
+    away mid-query the pass is redone once against the new file list.
+    """
+    log_dir = log_dir or _WRITER.log_dir
+    lo = start.replace(tzinfo=timezone.utc).timestamp() if start else -np.inf
+    hi = end.replace(tzinfo=timezone.utc).timestamp() if end else np.inf
+    ev = np.array([e.encode("utf-8")[:40] for e in events], dtype="S40") if events else None
+    try:
+        return _query_pass(log_dir, lo, hi, ev, page, page_size, strict=True)
+    except FileNotFoundError:
+        return _query_pass(log_dir, lo, hi, ev, page, page_size, strict=False)
+
+def _query_pass(log_dir: str, lo: float, hi: float, ev, page: int, page_size: int, strict: bool):
+    skip, total, out = page * page_size, 0, []
+    for path in _log_files(log_dir):
+        idx, _ = _cached_index(path)
+        if len(idx) == 0:
+            continue
+        mask = (idx["ts"] >= lo) & (idx["ts"] <= hi)
+        if ev is not None:
+            mask &= np.isin(idx["event"], ev)
+        hits = np.flatnonzero(mask)[::-1]  # newest first within the file
+        total += len(hits)
+        if len(out) < page_size and skip < len(hits):
+            take = hits[skip:skip + page_size - len(out)]
+            try:
+                out.extend(_read_lines(path, idx["offset"][take]))
+            except FileNotFoundError:
+                if strict:
+                    raise
+                total -= len(hits)  # gone again on the retry: skip the file
+                continue
+        skip = max(0, skip - len(hits))
+    return out, total
+
+def event_types(log_dir: str | None = None) -> list:
+    log_dir = log_dir or _WRITER.log_dir
+    names = set()
+    for path in _log_files(log_dir):
+        names |= _cached_index(path)[1]
+    return sorted(n for n in names if n)
+
+def read_tail(n: int = 200) -> list:
+    """Last n records across all files (oldest first)."""
+    records, _ = query(page_size=n)
+    return records[::-1]
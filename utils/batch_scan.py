@@ -0,0 +1,183 @@
+# utils/batch_scan.py
+"""
+Image authenticity scanning: image_auth_scan() for a single upload, and
+batch scans that decode + hash uploads in a process pool, then match every
+hash against the catalog matrix (all stored variants) in one vectorized pass.
+"""
+import io, os, time, zipfile
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from utils.image_match import (
+    IMAGE_EXTS, HASH_FUNCS, VARIANTS, RERANK, CatalogMatrix, decode_image, query_hashes, top_k_hash,
+    variant_distances, nearest_rows, rerank, popcount, similarity_pct,
+)
+
+def scan_verdict(dist, sim, dist_threshold, sim_threshold):
+    """Weighted 0–100 score plus verdict / explanation for one match, using the sidebar thresholds."""
+    # Weighted score (0–100): 70 from similarity, 30 from distance
+    sim_component = max(0.0, min(1.0, (sim or 0) / 100.0)) * 70
+    # Distance is 0 (best) to 64 (worst). Map to [0..1] where lower is better.
+    dist_component = 0.0
+    if dist is not None:
+        dist_component = max(0.0, min(1.0, (64 - float(dist)) / 64.0)) * 30
+
+    score = int(sim_component + dist_component)
+
+    if (dist is not None and dist <= dist_threshold) and (sim is not None and sim >= sim_threshold):
+        verdict = "Authentic ✅"
+        explanation = f"Similarity {sim:.1f}% ≥ {sim_threshold} and Hamming {dist} ≤ {dist_threshold}."
+    elif sim is not None and sim >= (sim_threshold - 8):
+        verdict = "Needs Review ⚠️"
+        explanation = f"Close match (Similarity {sim:.1f}%). Distance {dist} vs threshold {dist_threshold}."
+    else:
+        verdict = "Suspected Counterfeit ❌"
+        explanation = f"Similarity {sim:.1f}% below threshold or image signature too different (Hamming {dist})."
+    return verdict, score, explanation
+
+def image_auth_scan(query_hashes, catalog_hashes, dist_threshold, sim_threshold, n_alternatives=4):
+    """
+    Single-upload scan. query_hashes: {hash type: hex} of the upload (see upload_pipeline).
+    Returns a dict with best match and a clear verdict using your thresholds.
+    "alternatives" holds the next-closest catalog images (top-k) for manual review.
+    """
+    result = {
+        "best_file": None,
+        "product_id": None,
+        "distance": None,
+        "similarity": None,
+        "variant": None,
+        "verdict": "No catalog images found",
+        "score": 0,
+        "explanation": "",
+        "alternatives": []
+    }
+    if not catalog_hashes:
+        result["explanation"] = "Add trusted images to data/catalog for visual matching."
+        return result
+
+    hits = top_k_hash(query_hashes, catalog_hashes, k=n_alternatives + 1)
+    best = hits[0] if hits else None
+    if best is None:
+        result["verdict"] = "Scan failed"
+        result["explanation"] = "Could not compute image similarity."
+        return result
+    dist, sim = best["distance"], best["similarity"]
+    verdict, score, explanation = scan_verdict(dist, sim, dist_threshold, sim_threshold)
+    if best["variant"] != "orig":
+        explanation += f" Matched the catalog image's {best['variant']} variant."
+
+    result.update({
+        "best_file": best["file"],
+        "product_id": best["product_id"],
+        "distance": dist,
+        "similarity": sim,
+        "variant": best["variant"],
+        "verdict": verdict,
+        "score": score,
+        "explanation": explanation,
+        "alternatives": hits[1:]
+    })
+    return result
+
+def iter_zip_images(data: bytes):
+    """(name, bytes) for every image inside a zip archive, skipping macOS metadata."""
+    with zipfile.ZipFile(io.BytesIO(data)) as zf:
+        for info in zf.infolist():
+            name = info.filename
+            if info.is_dir() or "__MACOSX" in name or os.path.basename(name).startswith("."):
+                continue
+            if name.lower().endswith(IMAGE_EXTS):
+                yield name, zf.read(info)
+
+def _hash_one(item):
+    name, data = item
+    try:
+        src = data if isinstance(data, str) else io.BytesIO(data)
+        return name, query_hashes(decode_image(src)), ""
+    except Exception as e:
+        return name, None, f"{type(e).__name__}: {e}"
+
+def hash_images(items, workers: int | None = None, chunksize: int = 8):
+    """
+    items: iterable of (name, bytes | path).
+    Returns [(name, {hash type: hex} | None, error)] in input order.
+    """
+    items = list(items)
+    if workers == 1 or len(items) < 2 * chunksize:
+        return [_hash_one(it) for it in items]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(_hash_one, items, chunksize=chunksize))
+
+def match_hashes(queries: np.ndarray, matrix: CatalogMatrix, block_cells: int = 1 << 21):
+    """
+    Closest catalog row, distance and winning variant for each query.
+    queries: (m,) pHashes, or (m, hash types) in HASH_FUNCS order to use matrix.variants.
+    """
+    use_variants = queries.ndim == 2 and matrix.variants is not None
+    if queries.ndim == 2 and not use_variants:
+        queries = queries[:, list(HASH_FUNCS).index("phash")]
+    m = len(queries)
+    best_idx = np.zeros(m, dtype=np.int64)
+    best_dist = np.zeros(m, dtype=np.int64)
+    best_var = np.zeros(m, dtype=np.int64)
+    # Bound the (queries x catalog) distance block so memory stays flat for big catalogs
+    step = max(1, block_cells // max(1, len(matrix)))
+    for start in range(0, m, step):
+        q = queries[start:start + step]
+        rows = np.arange(len(q))
+        if use_variants:
+            # pHash against every variant, then the other hash types on each query's shortlist
+            best = variant_distances(q, matrix.variants)
+            c = min(RERANK, len(matrix))
+            cand = np.stack([nearest_rows(b, c) for b in best])
+            keys, var, dist = rerank(q, matrix.variants, cand)
+            j = (keys * len(matrix) + cand).argmin(axis=1)  # ties go to the lower row, as in top_k_hash()
+            idx, var, dist = cand[rows, j], var[rows, j], dist[rows, j]
+        else:
+            dists = popcount(np.bitwise_xor(q[:, None], matrix.hashes[None, :]).ravel()).reshape(len(q), len(matrix))
+            idx = dists.argmin(axis=1)
+            var = np.zeros(len(q), dtype=np.int64)
+            dist = dists[rows, idx]
+        best_idx[start:start + step] = idx
+        best_dist[start:start + step] = dist
+        best_var[start:start + step] = var
+    return best_idx, best_dist, best_var
+
+def batch_scan(items, matrix: CatalogMatrix, dist_threshold: int, sim_threshold: float, workers: int | None = None):
+    """
+    Scan many images at once.
+    Returns (results DataFrame, stats dict with images / seconds / images_per_sec).
+    """
+    t0 = time.perf_counter()
+    hashed = hash_images(items, workers=workers)
+
+    rows = []
+    ok = [i for i, (_, h, _) in enumerate(hashed) if h]
+    best_idx = best_dist = None
+    if ok and len(matrix):
+        q = np.array([[int(hashed[i][1][t], 16) for t in HASH_FUNCS] for i in ok], dtype=np.uint64)
+        best_idx, best_dist, best_var = match_hashes(q, matrix)
+    pos = {i: j for j, i in enumerate(ok)}
+
+    for i, (name, h, err) in enumerate(hashed):
+        row = {"file": name, "best_file": None, "product_id": None, "distance": None,
+               "similarity": None, "variant": None, "score": 0, "verdict": "Scan failed", "explanation": err}
+        if h and best_idx is None:
+            row.update(verdict="No catalog images found",
+                       explanation="Add trusted images to data/catalog for visual matching.")
+        elif h:
+            j = best_idx[pos[i]]
+            dist = int(best_dist[pos[i]])
+            sim = similarity_pct(dist)
+            verdict, score, explanation = scan_verdict(dist, sim, dist_threshold, sim_threshold)
+            row.update(best_file=matrix.files[j], product_id=matrix.product_ids[j], distance=dist,
+                       similarity=sim, variant=VARIANTS[best_var[pos[i]]], score=score, verdict=verdict, explanation=explanation)
+        rows.append(row)
+
+    seconds = time.perf_counter() - t0
+    stats = {"images": len(rows), "seconds": round(seconds, 3),
+             "images_per_sec": round(len(rows) / seconds, 1) if seconds > 0 else 0.0}
+    return pd.DataFrame(rows), stats
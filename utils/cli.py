@@ -0,0 +1,135 @@
+# utils/cli.py
+"""
+Headless entry points (no Streamlit import), e.g. for cron jobs:
+
+    python -m utils.cli score-invoices in.csv --out scored.parquet --risk-out supplier_risk.csv
+    python -m utils.cli fit-model reference.csv --name baseline
+    python -m utils.cli fit-model reference.csv --name per-supplier --segment-by supplier --workers 4
+    python -m utils.cli score-invoices in.csv --out scored.parquet --model baseline:2
+    python -m utils.cli score-invoices 2025-06-01.csv --out scored.parquet --model baseline --update-history
+    python -m utils.cli supplier-risk --windows 7 30 90
+    python -m utils.cli index-catalog data/catalog --workers 8
+"""
+import argparse, os, sys, time
+
+import pandas as pd
+
+from utils.model_store import fit_reference_model, save_model, load_model, parse_model_ref
+from utils.segmented import SEGMENT_BY, MIN_SEGMENT_ROWS
+from utils.streaming import score_stream
+from utils.ingest import read_table
+from utils.image_match import INDEX_PATH, index_catalog
+from utils.risk_store import WINDOWS, risk_windows, batch_id_for_file
+
+def _cmd_score_invoices(args):
+    if os.path.exists(args.out):
+        os.remove(args.out)
+    risk_out = args.risk_out or os.path.splitext(args.out)[0] + "_supplier_risk.csv"
+    bundle = load_model(*parse_model_ref(args.model)) if args.model else None
+    risk_batch = args.risk_batch or (batch_id_for_file(args.input) if args.update_history else None)
+    stats, risk, _ = score_stream(args.input, args.out, bundle=bundle,
+                                  contamination=args.contamination, random_state=args.random_state,
+                                  chunksize=args.chunksize, sample_rows=args.sample_rows,
+                                  log=(lambda m: None) if args.quiet else print, risk_batch=risk_batch,
+                                  segment_by=args.segment_by, min_segment_rows=args.min_segment_rows,
+                                  workers=args.workers)
+    risk.to_csv(risk_out, index=False)
+    print(f"done: {stats['rows']:,} rows in {stats['seconds']}s -> {args.out}, {risk_out}")
+
+def _cmd_fit_model(args):
+    df = read_table(args.input)
+    _, bundle = fit_reference_model(df, contamination=args.contamination, random_state=args.random_state,
+                                    segment_by=args.segment_by, min_segment_rows=args.min_segment_rows,
+                                    workers=args.workers)
+    meta = save_model(args.name, bundle, notes=args.notes or os.path.basename(args.input))
+    segs = f", {meta['n_segments']:,} {meta['segment_by']} segments" if meta.get("segment_by") else ""
+    print(f"saved {meta['name']}:{meta['version']} ({meta['trained_rows']:,} rows{segs})")
+
+def _cmd_supplier_risk(args):
+    table = risk_windows(args.windows, as_of=args.as_of)
+    if args.out:
+        table.to_csv(args.out, index=False)
+        print(f"{len(table):,} suppliers -> {args.out}")
+    else:
+        print(table.to_string(index=False))
+
+def _cmd_index_catalog(args):
+    last = [0.0]
+    def progress(done, total, elapsed):
+        if done == total or time.monotonic() - last[0] >= 2:
+            last[0] = time.monotonic()
+            print(f"hashed {done:,}/{total:,} ({done / elapsed:,.1f} images/s)", flush=True)
+    stats = index_catalog(args.catalog_dir, args.index, workers=args.workers, chunksize=args.chunksize,
+                          progress=None if args.quiet else progress)
+    print(f"done: {stats['indexed']:,} indexed, {stats['hashed']:,} hashed, {stats['removed']:,} removed, "
+          f"{len(stats['failed']):,} failed in {stats['seconds']}s -> {args.index}")
+    if stats["failed"]:
+        if args.failed_out:
+            pd.DataFrame(stats["failed"], columns=["file", "error"]).to_csv(args.failed_out, index=False)
+            print(f"failed files -> {args.failed_out}")
+        else:
+            for fn, err in stats["failed"][:20]:
+                print(f"  failed: {fn}: {err}")
+    return 1 if stats["failed"] and args.strict else 0
+
+def build_parser() -> argparse.ArgumentParser:
+    ap = argparse.ArgumentParser(prog="python -m utils.cli")
+    sub = ap.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("score-invoices", help="Score an invoice CSV with IsolationForest")
+    p.add_argument("input", help="invoice CSV, Parquet or Arrow file")
+    p.add_argument("--out", required=True, help="scored output (.parquet or .csv)")
+    p.add_argument("--risk-out", help="supplier risk CSV (default: <out>_supplier_risk.csv)")
+    p.add_argument("--contamination", type=float, default=0.07)
+    p.add_argument("--random-state", type=int, default=42)
+    p.add_argument("--chunksize", type=int, default=200_000, help="rows per chunk (bounds peak memory)")
+    p.add_argument("--sample-rows", type=int, default=200_000,
+                   help="without --model: fit on a uniform sample of this many rows (extra read pass)")
+    p.add_argument("--model", help="saved model as name or name:version (see fit-model)")
+    p.add_argument("--segment-by", choices=SEGMENT_BY,
+                   help="without --model: fit one forest per segment (sample keeps supplier/item)")
+    p.add_argument("--min-segment-rows", type=int, default=MIN_SEGMENT_ROWS,
+                   help="with --segment-by: smaller segments (in the sample) are scored by the global forest")
+    p.add_argument("--workers", type=int, help="processes for fitting / scoring segments (default: CPU count)")
+    p.add_argument("--update-history", action="store_true",
+                   help="merge per-supplier daily sums into the risk history (batch id = hash of the input's content)")
+    p.add_argument("--risk-batch", help="batch id for --update-history; re-running a batch id replaces it")
+    p.add_argument("-q", "--quiet", action="store_true")
+    p.set_defaults(func=_cmd_score_invoices)
+
+    p = sub.add_parser("fit-model", help="Fit an IsolationForest on a reference CSV and save it to the model store")
+    p.add_argument("input", help="reference invoice CSV, Parquet or Arrow file")
+    p.add_argument("--name", required=True)
+    p.add_argument("--contamination", type=float, default=0.07)
+    p.add_argument("--random-state", type=int, default=42)
+    p.add_argument("--segment-by", choices=SEGMENT_BY,
+                   help="one forest per supplier / item / supplier_item / item cluster, global fallback")
+    p.add_argument("--min-segment-rows", type=int, default=MIN_SEGMENT_ROWS,
+                   help="smaller segments are scored by the global forest")
+    p.add_argument("--workers", type=int, help="processes for fitting segments (default: CPU count)")
+    p.add_argument("--notes")
+    p.set_defaults(func=_cmd_fit_model)
+
+    p = sub.add_parser("supplier-risk", help="Windowed supplier risk from the stored history (no raw invoices read)")
+    p.add_argument("--windows", type=int, nargs="+", default=list(WINDOWS), help="window lengths in days")
+    p.add_argument("--as-of", help="last day of the windows, YYYY-MM-DD (default: latest stored day)")
+    p.add_argument("--out", help="write the table to this CSV instead of printing it")
+    p.set_defaults(func=_cmd_supplier_risk)
+
+    p = sub.add_parser("index-catalog", help="Hash new / changed catalog images into the persistent index")
+    p.add_argument("catalog_dir", nargs="?", default=os.path.join("data", "catalog"))
+    p.add_argument("--index", default=INDEX_PATH, help="index file (default: %(default)s)")
+    p.add_argument("--workers", type=int, default=None, help="hashing processes (default: all cores)")
+    p.add_argument("--chunksize", type=int, default=16, help="images per worker task")
+    p.add_argument("--failed-out", help="write failed files + errors to this CSV")
+    p.add_argument("--strict", action="store_true", help="exit 1 if any file failed")
+    p.add_argument("-q", "--quiet", action="store_true")
+    p.set_defaults(func=_cmd_index_catalog)
+    return ap
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    return args.func(args)
+
+if __name__ == "__main__":
+    sys.exit(main())
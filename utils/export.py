@@ -0,0 +1,46 @@
+# utils/export.py
+"""
+On-demand exports of (potentially large) result frames.
+CSV is written in chunks, Excel through openpyxl's write-only workbook
+(rows are streamed instead of building a cell tree), Parquet via pyarrow.
+"""
+import io
+
+import pandas as pd
+
+def csv_bytes(df: pd.DataFrame, chunksize: int = 100_000) -> bytes:
+    # Each chunk is encoded as it is written, so only one chunk's text exists at a time
+    buf = io.BytesIO()
+    for start in range(0, max(len(df), 1), chunksize):
+        buf.write(df.iloc[start:start + chunksize].to_csv(index=False, header=(start == 0)).encode("utf-8"))
+    return buf.getvalue()
+
+def excel_bytes(df: pd.DataFrame, sheet_name: str = "Sheet1", chunksize: int = 50_000) -> bytes:
+    from openpyxl import Workbook
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(title=sheet_name)
+    ws.append([str(c) for c in df.columns])
+    for start in range(0, len(df), chunksize):
+        chunk = df.iloc[start:start + chunksize].astype(object)
+        chunk = chunk.where(chunk.notna(), None)
+        for row in chunk.itertuples(index=False, name=None):
+            ws.append(row)
+    bio = io.BytesIO()
+    wb.save(bio)
+    return bio.getvalue()
+
+def parquet_bytes(df: pd.DataFrame) -> bytes:
+    bio = io.BytesIO()
+    df.to_parquet(bio, index=False)
+    return bio.getvalue()
+
+# label -> (writer, file extension, mime type)
+EXPORT_FORMATS = {
+    "CSV": (csv_bytes, "csv", "text/csv"),
+    "Excel": (excel_bytes, "xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+    "Parquet": (parquet_bytes, "parquet", "application/octet-stream"),
+}
+
+def export_bytes(df: pd.DataFrame, fmt: str, **kwargs) -> bytes:
+    writer, _, _ = EXPORT_FORMATS[fmt]
+    return writer(df, **kwargs)
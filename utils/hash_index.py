@@ -0,0 +1,85 @@
+# utils/hash_index.py
+"""
+BK-tree over 64-bit perceptual hashes packed into Python ints.
+Hamming distance is a metric, so the triangle inequality lets a query skip
+every subtree whose edge distance is outside [d - r, d + r].
+"""
+
+def hash_to_int(h) -> int:
+    """ImageHash (or hex string) -> packed int."""
+    if isinstance(h, int):
+        return h
+    return int(str(h), 16)
+
+def hamming(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+class BKTree:
+    def __init__(self, items=None):
+        # node = [hash_int, payloads, {edge_distance: child_node}]
+        self._root = None
+        self._size = 0
+        for h, payload in (items or []):
+            self.add(h, payload)
+
+    def __len__(self):
+        return self._size
+
+    def add(self, h, payload=None):
+        h = hash_to_int(h)
+        self._size += 1
+        if self._root is None:
+            self._root = [h, [payload], {}]
+            return
+        node = self._root
+        while True:
+            d = hamming(h, node[0])
+            if d == 0:
+                node[1].append(payload)  # identical hash, keep both payloads
+                return
+            child = node[2].get(d)
+            if child is None:
+                node[2][d] = [h, [payload], {}]
+                return
+            node = child
+
+    def within(self, h, radius: int):
+        """All (distance, payload) with distance <= radius, closest first."""
+        h = hash_to_int(h)
+        out = []
+        if self._root is None:
+            return out
+        stack = [self._root]
+        while stack:
+            node = stack.pop()
+            d = hamming(h, node[0])
+            if d <= radius:
+                out.extend((d, p) for p in node[1])
+            lo, hi = d - radius, d + radius
+            for edge, child in node[2].items():
+                if lo <= edge <= hi:
+                    stack.append(child)
+        out.sort(key=lambda x: x[0])
+        return out
+
+    def nearest(self, h, max_dist: int = 64):
+        """(distance, payload) of the closest hash, or (None, None) if empty / nothing within max_dist."""
+        h = hash_to_int(h)
+        best_d, best_p = max_dist + 1, None
+        if self._root is None:
+            return None, None
+        stack = [self._root]
+        while stack:
+            node = stack.pop()
+            d = hamming(h, node[0])
+            if d < best_d:
+                best_d, best_p = d, node[1][0]
+                if d == 0:
+                    break
+            lo, hi = d - best_d, d + best_d
+            for edge, child in node[2].items():
+                if lo < edge < hi:
+                    stack.append(child)
+        if best_d > max_dist:
+            return None, None
+        return best_d, best_p
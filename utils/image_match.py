@@ -1,29 +1,422 @@
-from PIL import Image
-import imagehash, os
-from typing import List, Tuple
+from PIL import Image, ImageOps
+import imagehash, os, json, time, threading
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from utils.hash_index import BKTree, hash_to_int
 
-def load_catalog_hashes(catalog_dir: str):
-    entries = []
-    if not os.path.isdir(catalog_dir):
-        return entries
-    for fn in os.listdir(catalog_dir):
-        if fn.lower().endswith((".jpg",".jpeg",".png",".webp",".bmp")):
-            path = os.path.join(catalog_dir, fn)
+IMAGE_EXTS = (".jpg",".jpeg",".png",".webp",".bmp")
+INDEX_PATH = os.path.join("data", "catalog_index.json")
+
+INDEX_VERSION = 3   # bump when hashing changes; older index files are re-hashed
+WORK_SIZE = 768     # longest side images are decoded to before hashing / preview
+HASH_INPUT = 256    # hashes are computed on a grayscale copy this size (all resize far below it)
+RESCAN_INTERVAL = 30.0  # seconds load_catalog_hashes() trusts the in-memory index before re-checking directories
+
+def _whash(img: Image.Image):
+    # Fixed scale, so the hash doesn't depend on the decoded resolution
+    return imagehash.whash(img, image_scale=64)
+
+# Hash types and geometric variants precomputed per catalog image at index time.
+# Queries hash only the upload as-is and match its pHash against every variant,
+# so rotated / mirrored / cropped photos still match; the other hash types only
+# re-rank the closest RERANK rows. Reported distances stay pHash distances, the
+# scale the UI thresholds were calibrated on.
+HASH_FUNCS = {"phash": imagehash.phash, "dhash": imagehash.dhash, "whash": _whash}
+VARIANTS = ["orig", "rot90", "rot180", "rot270", "mirror", "crop"]
+CROP_KEEP = 0.8  # centre crop used for the "crop" variant
+RERANK = 32      # pHash shortlist per query re-ranked with every hash type
+_PHASH = list(HASH_FUNCS).index("phash")
+_KEY_SCALE = 64 * len(HASH_FUNCS) + 1  # re-rank key: pHash distance, then summed distance over all types
+
+# In-memory copy of the on-disk index, shared by every session in this process.
+# {catalog_dir: {"files": {rel_path: {"mtime_ns", "size", "hash", "variants", "error"}}, "entries": [...],
+#                "dirs": {rel_dir: mtime_ns}, "checked": monotonic time of the last walk / directory check}}
+_INDEX_CACHE = {}
+_INDEX_LOCK = threading.Lock()
+_BUILD_LOCK = threading.Lock()  # one index_catalog() run at a time per process
+
+def _rgb(img: Image.Image) -> Image.Image:
+    # convert() always copies; skip it for images that are already RGB
+    return img if img.mode == "RGB" else img.convert("RGB")
+
+def decode_image(src, max_side: int = WORK_SIZE) -> Image.Image:
+    """
+    RGB image no larger than max_side, decoded as cheaply as possible: JPEG draft
+    mode lets the decoder scale by 1/2..1/8 up front, then a single thumbnail()
+    pass. EXIF orientation is applied so previews come out upright.
+    """
+    with Image.open(src) as im:
+        im.draft("RGB", (max_side, max_side))
+        img = ImageOps.exif_transpose(im)
+    img = _rgb(img)
+    img.thumbnail((max_side, max_side))
+    return img
+
+def _variant_images(img: Image.Image):
+    w, h = img.size
+    dw, dh = int(w * (1 - CROP_KEEP) / 2), int(h * (1 - CROP_KEEP) / 2)
+    return [
+        img,
+        img.transpose(Image.Transpose.ROTATE_90),
+        img.transpose(Image.Transpose.ROTATE_180),
+        img.transpose(Image.Transpose.ROTATE_270),
+        img.transpose(Image.Transpose.FLIP_LEFT_RIGHT),
+        img.crop((dw, dh, w - dw, h - dh)),
+    ]
+
+def _hash_input(img: Image.Image) -> Image.Image:
+    # Every hash converts to grayscale and shrinks; doing it once up front makes
+    # the per-hash resizes (and the catalog-side variants) nearly free
+    small = img.convert("L")
+    small.thumbnail((HASH_INPUT, HASH_INPUT))
+    return small
+
+def query_hashes(img: Image.Image) -> dict:
+    """{hash type: hex} for an upload, taken as-is (variants live on the catalog side)."""
+    small = _hash_input(img)
+    return {t: str(f(small)) for t, f in HASH_FUNCS.items()}
+
+def _hash_file(path: str) -> dict:
+    """{hash type: [hex per VARIANTS entry]} for one catalog image."""
+    imgs = _variant_images(_hash_input(decode_image(path, HASH_INPUT)))
+    return {t: [str(f(im)) for im in imgs] for t, f in HASH_FUNCS.items()}
+
+def _scan_catalog(catalog_dir: str):
+    """
+    Stat every catalog image, recursively; cheap compared to decoding + hashing.
+    Returns ({rel_path: (mtime_ns, size)}, {rel_dir: mtime_ns}); paths are relative
+    to catalog_dir with "/" separators.
+    """
+    found, dirs = {}, {}
+    stack = [""]
+    while stack:
+        rel_dir = stack.pop()
+        try:
+            dirs[rel_dir] = os.stat(os.path.join(catalog_dir, rel_dir)).st_mtime_ns
+            it = os.scandir(os.path.join(catalog_dir, rel_dir))
+        except OSError:
+            continue
+        with it:
+            for e in it:
+                rel = f"{rel_dir}/{e.name}" if rel_dir else e.name
+                try:
+                    if e.is_dir(follow_symlinks=False):
+                        if not e.name.startswith("."):
+                            stack.append(rel)
+                    elif e.name.lower().endswith(IMAGE_EXTS):
+                        st = e.stat()
+                        found[rel] = (st.st_mtime_ns, st.st_size)
+                except OSError:
+                    continue
+    return found, dirs
+
+def _dirs_changed(catalog_dir: str, dirs: dict) -> bool:
+    """True if any directory seen by the last walk was modified or removed (files added / removed / renamed)."""
+    for rel_dir, mtime_ns in dirs.items():
+        try:
+            if os.stat(os.path.join(catalog_dir, rel_dir)).st_mtime_ns != mtime_ns:
+                return True
+        except OSError:
+            return True
+    return False
+
+def _read_index(index_path: str, catalog_dir: str) -> dict:
+    if not os.path.exists(index_path):
+        return {}
+    try:
+        with open(index_path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if data.get("catalog_dir") != catalog_dir or data.get("version") != INDEX_VERSION:
+        return {}
+    return data.get("files", {})
+
+def _write_index(index_path: str, catalog_dir: str, files: dict):
+    os.makedirs(os.path.dirname(index_path) or ".", exist_ok=True)
+    tmp = index_path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"version": INDEX_VERSION, "catalog_dir": catalog_dir, "files": files}, f)
+    os.replace(tmp, index_path)
+
+def _hash_one(args):
+    catalog_dir, fn = args
+    try:
+        return fn, _hash_file(os.path.join(catalog_dir, fn)), ""
+    except Exception as e:
+        return fn, None, f"{type(e).__name__}: {e}"
+
+def _entries(files: dict) -> list:
+    return [{"file": fn, "hash": imagehash.hex_to_hash(rec["hash"]), "variants": rec["variants"]}
+            for fn, rec in sorted(files.items()) if rec["hash"]]
+
+def index_catalog(catalog_dir: str, index_path: str = INDEX_PATH, workers: int | None = 1,
+                  progress=None, chunksize: int = 16, checkpoint_every: int = 20_000) -> dict:
+    """
+    Bring the persistent index up to date with catalog_dir (walked recursively).
+    Only new or changed images are hashed, in a process pool unless workers=1;
+    the index is checkpointed every checkpoint_every images so an interrupted
+    rebuild resumes where it stopped. progress(done, total, elapsed_s) is called
+    after every image. Failed files are kept in the index with their error.
+
+    Returns {"files", "indexed", "removed", "hashed", "failed": [(file, error)],
+             "seconds", "images_per_sec"}.
+    """
+    t0 = time.perf_counter()
+    key = os.path.abspath(catalog_dir)
+    with _BUILD_LOCK:
+        with _INDEX_LOCK:
+            cached = _INDEX_CACHE.get(key)
+        files = dict(cached["files"]) if cached else _read_index(index_path, key)
+        found, dirs = _scan_catalog(catalog_dir) if os.path.isdir(catalog_dir) else ({}, {})
+
+        removed = [fn for fn in files if fn not in found]
+        for fn in removed:
+            del files[fn]
+        todo = [fn for fn, (mtime_ns, size) in found.items()
+                if not ((rec := files.get(fn)) and rec.get("mtime_ns") == mtime_ns and rec.get("size") == size
+                        and (rec["hash"] is None or _has_variants(rec)))]
+
+        failed = []
+        if todo:
+            jobs = [(catalog_dir, fn) for fn in todo]
+            pool = ProcessPoolExecutor(max_workers=workers) if workers != 1 and len(todo) >= 2 * chunksize else None
+            results = pool.map(_hash_one, jobs, chunksize=chunksize) if pool else map(_hash_one, jobs)
             try:
-                img = Image.open(path).convert("RGB")
-                ph = imagehash.phash(img)
-                entries.append({"file": fn, "hash": ph})
-            except Exception:
-                continue
-    return entries
+                for done, (fn, variants, err) in enumerate(results, 1):
+                    mtime_ns, size = found[fn]
+                    # Failures are remembered (hash None) so unreadable files aren't retried every rerun
+                    files[fn] = {"mtime_ns": mtime_ns, "size": size, "hash": variants["phash"][0] if variants else None,
+                                 "variants": variants, "error": err or None}
+                    if err:
+                        failed.append((fn, err))
+                    if done % checkpoint_every == 0:
+                        _write_index(index_path, key, files)
+                    if progress:
+                        progress(done, len(todo), time.perf_counter() - t0)
+            finally:
+                if pool:
+                    pool.shutdown(cancel_futures=True)
+
+        with _INDEX_LOCK:
+            if todo or removed:
+                _write_index(index_path, key, files)
+            if todo or removed or cached is None:
+                _INDEX_CACHE[key] = cached = {"files": files, "entries": _entries(files)}
+            cached.update(dirs=dirs, checked=time.monotonic())
+
+    seconds = time.perf_counter() - t0
+    return {"files": len(found), "indexed": sum(1 for r in files.values() if r["hash"]),
+            "removed": len(removed), "hashed": len(todo), "failed": failed,
+            "seconds": round(seconds, 3),
+            "images_per_sec": round(len(todo) / seconds, 1) if todo and seconds > 0 else 0.0}
+
+def load_catalog_hashes(catalog_dir: str, index_path: str = INDEX_PATH):
+    """
+    Returns [{"file", "hash", "variants"}] for every catalog image; "hash" is the
+    plain pHash, "variants" maps each HASH_FUNCS type to one hex per VARIANTS entry.
+    Hashes are kept in a persistent index keyed by file path + mtime + size, so
+    only added or changed images are decoded; deleted ones are dropped.
+
+    Once loaded, the catalog is not walked again per call: for RESCAN_INTERVAL
+    seconds the in-memory index is served as is, after that only the directories'
+    mtimes are checked, and a full walk happens when one changed (an image added,
+    removed or renamed). Images overwritten in place are picked up by an explicit
+    index_catalog() run (CLI index-catalog or the Product Catalog tab button).
+    While a bulk index_catalog() run is in progress the last loaded index is served.
+    """
+    if not os.path.isdir(catalog_dir):
+        return []
+    key = os.path.abspath(catalog_dir)
+    with _INDEX_LOCK:
+        cached = _INDEX_CACHE.get(key)
+    if cached is not None and "checked" in cached:
+        if _BUILD_LOCK.locked():
+            return cached["entries"]
+        now = time.monotonic()
+        if now - cached["checked"] < RESCAN_INTERVAL:
+            return cached["entries"]
+        if not _dirs_changed(catalog_dir, cached["dirs"]):
+            cached["checked"] = now
+            return cached["entries"]
+    index_catalog(catalog_dir, index_path, workers=1)
+    with _INDEX_LOCK:
+        return _INDEX_CACHE[key]["entries"]
+
+def _has_variants(rec: dict) -> bool:
+    # Older index files only carry the pHash; those records get re-hashed once
+    v = rec.get("variants") or {}
+    return all(len(v.get(t) or ()) == len(VARIANTS) for t in HASH_FUNCS)
+
+def load_catalog_tree(catalog_dir: str, index_path: str = INDEX_PATH) -> BKTree:
+    """BK-tree over the catalog pHashes, rebuilt only when the index changes."""
+    entries = load_catalog_hashes(catalog_dir, index_path)
+    key = os.path.abspath(catalog_dir)
+    with _INDEX_LOCK:
+        cached = _INDEX_CACHE.get(key)
+        if cached is None or cached.get("entries") is not entries:
+            return BKTree((hash_to_int(e["hash"]), e) for e in entries)
+        if "tree" not in cached:
+            cached["tree"] = BKTree((hash_to_int(e["hash"]), e) for e in entries)
+        return cached["tree"]
+
+def product_id_from_file(fn: str) -> str:
+    """Catalog files are named <product_id>_<n>.<ext>."""
+    return os.path.splitext(os.path.basename(fn))[0].split("_")[0]
+
+class CatalogMatrix:
+    """
+    Catalog pHashes as one contiguous uint64 array with parallel file / product-id arrays.
+    When every entry carries variants, .variants is a (hash types, VARIANTS, n) uint64
+    array in HASH_FUNCS / VARIANTS order (catalog axis last, so each XOR runs over
+    contiguous memory); otherwise it is None and only pHash is used.
+    """
+    def __init__(self, entries):
+        self.hashes = np.fromiter((hash_to_int(e["hash"]) for e in entries), dtype=np.uint64, count=len(entries))
+        self.files = np.array([e["file"] for e in entries], dtype=object)
+        self.product_ids = np.array([product_id_from_file(e["file"]) for e in entries], dtype=object)
+        self.variants = None
+        if entries and all(e.get("variants") for e in entries):
+            self.variants = np.ascontiguousarray(np.array(
+                [[[int(h, 16) for h in e["variants"][t]] for t in HASH_FUNCS] for e in entries],
+                dtype=np.uint64).transpose(1, 2, 0))
+
+    def __len__(self):
+        return len(self.hashes)
+
+if hasattr(np, "bitwise_count"):
+    def popcount(x: np.ndarray) -> np.ndarray:
+        """Set bits per element of a uint64 array (uint8 result)."""
+        return np.bitwise_count(x)
+else:
+    _POPCOUNT8 = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+    def popcount(x: np.ndarray) -> np.ndarray:
+        """Set bits per element of a uint64 array (uint8 result)."""
+        x = np.ascontiguousarray(x)
+        return _POPCOUNT8[x.view(np.uint8)].reshape(*x.shape, 8).sum(axis=-1, dtype=np.uint8)
+
+def hamming_distances(query, hashes: np.ndarray) -> np.ndarray:
+    """Hamming distance from one hash to every row of a uint64 array (XOR + popcount)."""
+    return popcount(np.bitwise_xor(hashes, np.uint64(hash_to_int(query)))).astype(np.int64)
+
+def _query_vector(q) -> np.ndarray:
+    return np.array([hash_to_int(q[t]) for t in HASH_FUNCS], dtype=np.uint64)
+
+def variant_distances(q, variants: np.ndarray) -> np.ndarray:
+    """
+    Best pHash distance per catalog row over all stored variants: (n,) for one query,
+    (m, n) for an (m, hash types) batch. q is a {hash type: hash} dict or a uint64
+    vector in HASH_FUNCS order; only its pHash is compared here (see rerank()).
+    """
+    qv = q if isinstance(q, np.ndarray) else _query_vector(q)
+    if qv.ndim == 1:
+        return popcount(np.bitwise_xor(variants[_PHASH], qv[_PHASH])).min(axis=0)
+    return popcount(np.bitwise_xor(variants[_PHASH][None], qv[:, _PHASH, None, None])).min(axis=1)
+
+def nearest_rows(dists: np.ndarray, c: int) -> np.ndarray:
+    """
+    Indices of the c smallest 0..64 distances (unordered; ties go to the lower rows).
+    A counting pass over the 65 possible values is several times faster than
+    argpartition on small integers.
+    """
+    cum = np.cumsum(np.bincount(dists, minlength=65))
+    cut = int(np.searchsorted(cum, c))
+    below = np.flatnonzero(dists < cut)
+    return np.concatenate([below, np.flatnonzero(dists == cut)[:c - len(below)]])
+
+def rerank(q, variants: np.ndarray, rows: np.ndarray):
+    """
+    Re-rank candidate rows (shaped (c,) for one query, (m, c) for a batch) with every
+    hash type. Returns (sort keys, winning variant, pHash distance), each shaped like
+    rows; keys order by pHash distance first and the summed distance over all types
+    second, each row taken at the variant that minimizes that.
+    """
+    qv = np.atleast_2d(q if isinstance(q, np.ndarray) else _query_vector(q))
+    r = np.atleast_2d(rows)
+    total = np.zeros((variants.shape[1],) + r.shape, dtype=np.int64)
+    for t in range(len(HASH_FUNCS)):
+        d = popcount(np.bitwise_xor(variants[t][:, r], qv[:, t, None])).astype(np.int64)
+        total += d * (_KEY_SCALE + 1) if t == _PHASH else d
+    var = total.argmin(axis=0)
+    keys = np.take_along_axis(total, var[None], axis=0)[0]
+    shape = np.shape(rows)
+    return keys.reshape(shape), var.reshape(shape), (keys // _KEY_SCALE).reshape(shape)
+
+def load_catalog_matrix(catalog_dir: str, index_path: str = INDEX_PATH) -> CatalogMatrix:
+    """CatalogMatrix over the catalog pHashes, rebuilt only when the index changes."""
+    entries = load_catalog_hashes(catalog_dir, index_path)
+    key = os.path.abspath(catalog_dir)
+    with _INDEX_LOCK:
+        cached = _INDEX_CACHE.get(key)
+        if cached is None or cached.get("entries") is not entries:
+            return CatalogMatrix(entries)
+        if "matrix" not in cached:
+            cached["matrix"] = CatalogMatrix(entries)
+        return cached["matrix"]
+
+def similarity_pct(dist) -> float:
+    """Similarity in percent for a 64-bit pHash Hamming distance (0 -> 100 %, 64 -> 0 %)."""
+    return max(0.0, 100.0 * (1.0 - float(dist)/64.0))
+
+def top_k_hash(ph, matrix: CatalogMatrix, k: int = 5):
+    """
+    k closest catalog rows as [{"file", "product_id", "distance", "similarity", "variant"}].
+    ph is a single pHash, or a query_hashes() dict to match against every stored variant
+    (pHash shortlist of RERANK rows, re-ranked with the other hash types). "distance" is
+    always a pHash Hamming distance.
+    """
+    if len(matrix) == 0:
+        return []
+    k = min(k, len(matrix))
+    if isinstance(ph, dict) and matrix.variants is not None:
+        qv = _query_vector(ph)
+        best = variant_distances(qv, matrix.variants)
+        c = min(max(k, RERANK), len(best))
+        cand = nearest_rows(best, c)
+        keys, var, ph_dist = rerank(qv, matrix.variants, cand)
+        order = np.lexsort((cand, keys))[:k]
+        idx, which, dists = cand[order], var[order], ph_dist[order]
+    else:
+        dists = hamming_distances(ph["phash"] if isinstance(ph, dict) else ph, matrix.hashes)
+        idx = nearest_rows(dists, k)
+        idx = idx[np.lexsort((idx, dists[idx]))]
+        which, dists = np.zeros(k, dtype=np.int64), dists[idx]
+    return [{"file": matrix.files[i], "product_id": matrix.product_ids[i], "distance": int(d),
+             "similarity": similarity_pct(d), "variant": VARIANTS[w]} for i, w, d in zip(idx, which, dists)]
+
+def top_k(upload_img: Image.Image, matrix: CatalogMatrix, k: int = 5, hash_func=None):
+    """Closest catalog rows to an upload; all hash types and variants unless hash_func is given."""
+    if hash_func is not None:
+        return top_k_hash(hash_func(_rgb(upload_img)), matrix, k)
+    q = query_hashes(upload_img) if matrix.variants is not None else imagehash.phash(_rgb(upload_img))
+    return top_k_hash(q, matrix, k)
+
+def clear_catalog_cache():
+    with _INDEX_LOCK:
+        _INDEX_CACHE.clear()
 
 def phash_distance(h1, h2) -> int:
     return h1 - h2
 
-def best_match(upload_img: Image.Image, catalog_hashes, hash_func=imagehash.phash):
+def matches_within(upload_img: Image.Image, tree: BKTree, dist_threshold: int, hash_func=imagehash.phash):
+    """All catalog entries within dist_threshold of the upload, as (entry, distance), closest first."""
+    ph = hash_func(_rgb(upload_img))
+    return [(entry, d) for d, entry in tree.within(ph, dist_threshold)]
+
+def best_match(upload_img: Image.Image, catalog_hashes, hash_func=None):
+    """
+    (entry, distance, similarity %) of the closest catalog image. hash_func defaults
+    to pHash (all stored variants for a CatalogMatrix, see top_k()).
+    """
     if not catalog_hashes:
         return None, None, None
-    ph = hash_func(upload_img.convert("RGB"))
+    if isinstance(catalog_hashes, CatalogMatrix):
+        hit = top_k(upload_img, catalog_hashes, k=1, hash_func=hash_func)[0]
+        return hit, hit["distance"], hit["similarity"]
+    ph = (hash_func or imagehash.phash)(_rgb(upload_img))
+    if isinstance(catalog_hashes, BKTree):
+        best_dist, best = catalog_hashes.nearest(ph)
+        return best, best_dist, similarity_pct(best_dist)
     best = None
     best_dist = 1e9
     for entry in catalog_hashes:
@@ -31,7 +424,4 @@ def best_match(upload_img: Image.Image, catalog_hashes, hash_func=imagehash.phas
         if d < best_dist:
             best_dist = d
             best = entry
-    # Normalize similarity from distance (0..64) into percent
-    # For 64-bit pHash, max Hamming distance is 64
-    similarity = max(0.0, 100.0 * (1.0 - best_dist/64.0))
-    return best, best_dist, similarity
+    return best, best_dist, similarity_pct(best_dist)
@@ -0,0 +1,224 @@
+# utils/ingest.py
+"""
+Typed table ingestion for CSV, Parquet and Arrow IPC (Feather v2) inputs.
+
+Columns get explicit dtypes instead of inference: NUMERIC_FEATURES as floats,
+supplier / item / brand / category as categoricals, identifiers as text.
+Parquet and Arrow files on disk are memory-mapped, and only the requested
+columns are read. Uploaded bytes are converted once to an uncompressed Arrow
+file under data/cache/tables (keyed by content hash), so later reruns
+memory-map it instead of parsing again.
+
+compact_frame() shrinks a scored frame before it is cached or kept in a
+session: float32 / int32 numerics, categorical labels, and a bytes-per-row
+report stored in df.attrs["memory"].
+"""
+import os, io, hashlib
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
+
+from utils.anomaly import NUMERIC_FEATURES
+
+TABLE_CACHE_DIR = os.path.join("data", "cache", "tables")
+MAX_CACHED_TABLES = 32
+
+INVOICE_DTYPES = {
+    **{c: "float64" for c in NUMERIC_FEATURES},
+    "supplier": "category",
+    "item": "category",
+    "invoice_id": str,
+    "date": str,
+}
+PRODUCT_DTYPES = {
+    "product_id": str, "brand": "category", "product_name": str, "model": str, "category": "category",
+    "sku": str, "gtin": str, "msrp": "float64", "serial_prefix": str, "image": str, "notes": str,
+}
+
+# Repeated labels become categoricals; numerics are downcast by compact_frame()
+COMPACT_CATEGORIES = ["invoice_id", "supplier", "item", "date", "reason_top_features", "model_segment"]
+COMPACT_FLOATS = list(NUMERIC_FEATURES) + ["anomaly_score"]
+
+PARQUET_EXT = (".parquet", ".pq")
+ARROW_EXT = (".arrow", ".feather", ".ipc")
+
+def table_format(head: bytes, name: str | None = None) -> str:
+    """"parquet", "arrow", "arrow_stream" or "csv", from the file name or its first bytes."""
+    ext = os.path.splitext(name or "")[1].lower()
+    if ext in PARQUET_EXT or head[:4] == b"PAR1":
+        return "parquet"
+    if head[:6] == b"ARROW1":
+        return "arrow"
+    if head[:4] == b"\xff\xff\xff\xff":
+        return "arrow_stream"
+    if ext in ARROW_EXT:
+        return "arrow"
+    return "csv"
+
+def _source(src, name: str | None = None):
+    """(pyarrow-readable source, format, path or None) for a path, bytes or a file object."""
+    if isinstance(src, (str, os.PathLike)):
+        path = os.fspath(src)
+        with open(path, "rb") as f:
+            head = f.read(8)
+        return path, table_format(head, path), path
+    if isinstance(src, (bytes, bytearray, memoryview)):
+        data = bytes(src)
+    else:
+        name = name or getattr(src, "name", None)
+        src.seek(0)
+        data = src.read()
+    return data, table_format(data[:8], name), None
+
+def apply_dtypes(df: pd.DataFrame, dtypes: dict) -> pd.DataFrame:
+    """Coerce numeric columns (bad values -> NaN) and make categorical ones categorical, in place."""
+    for c, t in dtypes.items():
+        if c not in df.columns:
+            continue
+        if t == "category":
+            if not isinstance(df[c].dtype, pd.CategoricalDtype):
+                df[c] = df[c].astype("category")
+        elif t is not str and df[c].dtype != t:
+            df[c] = pd.to_numeric(df[c], errors="coerce").astype(t)
+    return df
+
+def _csv_kwargs(columns, dtypes: dict) -> dict:
+    # Text and categorical columns are typed by the parser; numerics are coerced afterwards
+    kw = {"dtype": {c: t for c, t in dtypes.items() if t is str or t == "category"}}
+    if columns is not None:
+        wanted = set(columns)
+        kw["usecols"] = lambda c: c in wanted
+    return kw
+
+def _arrow_table(source, fmt: str, path: str | None) -> pa.Table:
+    if path is not None:
+        source = pa.memory_map(path, "r")
+    else:
+        source = pa.BufferReader(source)
+    if fmt == "arrow":
+        return pa.ipc.open_file(source).read_all()
+    return pa.ipc.open_stream(source).read_all()
+
+def _project(table: pa.Table, columns) -> pa.Table:
+    if columns is None:
+        return table
+    return table.select([c for c in columns if c in table.column_names])
+
+def read_table(src, columns=None, dtypes: dict = INVOICE_DTYPES, name: str | None = None) -> pd.DataFrame:
+    """
+    DataFrame from a CSV / Parquet / Arrow path, bytes or file object. `columns`
+    restricts what is read (names missing from the file are skipped).
+    """
+    source, fmt, path = _source(src, name)
+    if fmt == "csv":
+        df = pd.read_csv(source if path else io.BytesIO(source), **_csv_kwargs(columns, dtypes))
+    elif fmt == "parquet":
+        pf = pq.ParquetFile(source if path else pa.BufferReader(source), memory_map=path is not None)
+        names = pf.schema_arrow.names
+        df = pf.read(columns=None if columns is None else [c for c in columns if c in names]).to_pandas()
+    else:
+        df = _project(_arrow_table(source, fmt, path), columns).to_pandas()
+    return apply_dtypes(df, dtypes)
+
+def iter_batches(src, chunksize: int = 200_000, columns=None, dtypes: dict = INVOICE_DTYPES, name: str | None = None):
+    """read_table() in frames of up to chunksize rows, without loading a CSV or Parquet file whole."""
+    source, fmt, path = _source(src, name)
+    if fmt == "csv":
+        reader = pd.read_csv(source if path else io.BytesIO(source), chunksize=chunksize, **_csv_kwargs(columns, dtypes))
+        for chunk in reader:
+            yield apply_dtypes(chunk, dtypes)
+    elif fmt == "parquet":
+        pf = pq.ParquetFile(source if path else pa.BufferReader(source), memory_map=path is not None)
+        names = pf.schema_arrow.names
+        cols = None if columns is None else [c for c in columns if c in names]
+        for batch in pf.iter_batches(batch_size=chunksize, columns=cols):
+            yield apply_dtypes(batch.to_pandas(), dtypes)
+    else:
+        # Memory-mapped IPC slices are zero-copy until converted to pandas
+        table = _project(_arrow_table(source, fmt, path), columns)
+        for start in range(0, table.num_rows, chunksize):
+            yield apply_dtypes(table.slice(start, chunksize).to_pandas(), dtypes)
+
+def _evict_tables():
+    files = [os.path.join(TABLE_CACHE_DIR, f) for f in os.listdir(TABLE_CACHE_DIR) if f.endswith(".arrow")]
+    files.sort(key=os.path.getmtime)
+    for path in files[:max(0, len(files) - MAX_CACHED_TABLES)]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+def cached_table(data: bytes, name: str | None = None, columns=None, dtypes: dict = INVOICE_DTYPES) -> pd.DataFrame:
+    """
+    read_table() for uploaded bytes through the Arrow cache: the first call parses
+    and writes data/cache/tables/<sha256>.arrow; later calls memory-map it.
+    """
+    path = os.path.join(TABLE_CACHE_DIR, hashlib.sha256(data).hexdigest()[:32] + ".arrow")
+    if os.path.exists(path):
+        os.utime(path)
+        return read_table(path, columns, dtypes)
+    df = read_table(data, None, dtypes, name)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(TABLE_CACHE_DIR, exist_ok=True)
+        feather.write_feather(df, tmp, compression="uncompressed")
+        os.replace(tmp, path)
+        _evict_tables()
+    except (pa.ArrowException, OSError):
+        # Columns Arrow cannot type (mixed objects): serve without caching
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return df if columns is None else df[[c for c in columns if c in df.columns]]
+
+def memory_report(df: pd.DataFrame) -> dict:
+    """{"rows", "bytes", "bytes_per_row", "columns": {name: bytes}} (deep: string payloads included)."""
+    cols = df.memory_usage(deep=True, index=False)
+    total = int(cols.sum())
+    return {"rows": len(df), "bytes": total, "bytes_per_row": round(total / len(df), 1) if len(df) else 0.0,
+            "columns": {c: int(b) for c, b in cols.items()}}
+
+def _int32_ok(values: np.ndarray) -> bool:
+    finite = np.isfinite(values)
+    if not finite.all():
+        return False
+    return bool(len(values) == 0 or (np.all(values == np.round(values))
+                and values.min() >= np.iinfo(np.int32).min and values.max() <= np.iinfo(np.int32).max))
+
+def compact_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Downcast in place: whole-number features to int32, other floats to float32
+    (the forest works in float32 anyway, so scores do not change), labels in
+    COMPACT_CATEGORIES to categoricals. Records {"before", "after"} memory_report()
+    summaries in df.attrs["memory"] and returns df.
+    """
+    before = memory_report(df)
+    for c in COMPACT_FLOATS:
+        if c in df.columns and pd.api.types.is_numeric_dtype(df[c]) and not pd.api.types.is_bool_dtype(df[c]):
+            values = df[c].to_numpy(dtype=np.float64)
+            if c != "anomaly_score" and _int32_ok(values):
+                df[c] = values.astype(np.int32)
+            elif df[c].dtype != np.float32:
+                df[c] = values.astype(np.float32)
+    for c in COMPACT_CATEGORIES:
+        if c in df.columns and not isinstance(df[c].dtype, pd.CategoricalDtype):
+            df[c] = df[c].astype("category")
+    after = memory_report(df)
+    df.attrs["memory"] = {k: {"bytes": r["bytes"], "bytes_per_row": r["bytes_per_row"]}
+                          for k, r in (("before", before), ("after", after))}
+    return df
+
+def widen_floats(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Copy with float32 columns turned back into float64 via their shortest decimal
+    form, so grids and Excel show 32.63 rather than 32.630001068115234.
+    """
+    f32 = [c for c in df.columns if df[c].dtype == np.float32]
+    if not f32:
+        return df
+    out = df.copy()
+    for c in f32:
+        out[c] = out[c].astype(str).astype(np.float64)
+    return out
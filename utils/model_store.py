@@ -0,0 +1,145 @@
+# utils/model_store.py
+"""
+Local, versioned store of fitted IsolationForest models.
+
+Layout: data/models/<name>/v<N>.joblib (model bundle) + v<N>.json (metadata).
+A bundle carries everything needed to score new data exactly like the
+reference window: the forest, the imputation medians and the z-score stats.
+Segmented bundles (utils.segmented) add one forest per supplier / item /
+cluster on top of the global one.
+"""
+import os, re, json
+from datetime import datetime
+
+import joblib
+import pandas as pd
+
+from utils.anomaly import (
+    NUMERIC_FEATURES, prepare_dataframe, feature_medians, zscore_stats,
+    fit_isolation_forest, score_isolation_forest,
+)
+from utils.segmented import fit_segmented_model, score_segmented, MIN_SEGMENT_ROWS
+
+MODEL_DIR = os.path.join("data", "models")
+_NAME_RE = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_.-]*$")   # leading alphanumeric: no ".", ".." or hidden dirs
+
+def fit_reference_model(df: pd.DataFrame, contamination: float = 0.07, random_state: int = 42,
+                        segment_by: str | None = None, min_segment_rows: int = MIN_SEGMENT_ROWS,
+                        workers: int | None = None, inplace: bool = False):
+    """
+    Fit on a raw reference window. Returns (scored reference frame, bundle).
+    segment_by ("supplier", "item", "supplier_item", "cluster") fits segmented forests instead.
+    inplace=True prepares and scores `df` itself instead of a copy.
+    """
+    if segment_by:
+        return fit_segmented_model(df, segment_by, contamination, random_state,
+                                   min_rows=min_segment_rows, workers=workers, inplace=inplace)
+    medians = feature_medians(df)
+    prepared = prepare_dataframe(df, medians, copy=not inplace)
+    zstats = zscore_stats(prepared)
+    scored, clf = fit_isolation_forest(prepared, contamination=contamination, random_state=random_state, inplace=True)
+    bundle = {
+        "clf": clf,
+        "medians": medians,
+        "zstats": zstats,
+        "features": list(NUMERIC_FEATURES),
+        "contamination": contamination,
+        "random_state": random_state,
+        "trained_rows": len(prepared),
+    }
+    return scored, bundle
+
+def score_with_model(df: pd.DataFrame, bundle: dict, inplace: bool = False, workers: int | None = None) -> pd.DataFrame:
+    """Inference only: impute with the bundle's medians and score with its forest(s) (workers: segmented only)."""
+    if bundle.get("kind") == "segmented":
+        return score_segmented(df, bundle, workers=workers, inplace=inplace)
+    return score_isolation_forest(prepare_dataframe(df, bundle["medians"], copy=not inplace),
+                                  bundle["clf"], bundle["zstats"], inplace=True)
+
+def _versions(name: str) -> list[int]:
+    path = os.path.join(MODEL_DIR, name)
+    if not os.path.isdir(path):
+        return []
+    return sorted(int(m.group(1)) for fn in os.listdir(path) if (m := re.match(r"^v(\d+)\.joblib$", fn)))
+
+def _reserve_version(path: str):
+    """
+    Claim the next free version number by creating its .json exclusively (O_EXCL),
+    retrying with the next number when a concurrent save got there first.
+    Returns (version, open file descriptor of the empty .json).
+    """
+    while True:
+        taken = [int(m.group(1)) for fn in os.listdir(path) if (m := re.match(r"^v(\d+)\.(?:joblib|json)$", fn))]
+        version = max(taken, default=0) + 1
+        try:
+            return version, os.open(os.path.join(path, f"v{version}.json"), os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+        except FileExistsError:
+            continue
+
+def save_model(name: str, bundle: dict, notes: str = "") -> dict:
+    """
+    Store the bundle as the next version of `name`; returns its metadata.
+    The version's .joblib appears only once complete (written aside, then renamed),
+    so readers never load a partial model.
+    """
+    if not _NAME_RE.fullmatch(name or ""):
+        raise ValueError("Model name must start with a letter or digit and may only contain letters, digits, "
+                         "'.', '_' and '-'.")
+    path = os.path.join(MODEL_DIR, name)
+    os.makedirs(path, exist_ok=True)
+    version, fd = _reserve_version(path)
+    meta = {
+        "name": name,
+        "version": version,
+        "created": datetime.utcnow().isoformat(timespec="seconds"),
+        "contamination": bundle["contamination"],
+        "random_state": bundle["random_state"],
+        "trained_rows": bundle["trained_rows"],
+        "features": bundle["features"],
+        "medians": bundle["medians"],
+        "segment_by": bundle.get("segment_by"),
+        "n_segments": bundle.get("n_segments"),
+        "notes": notes,
+    }
+    base = os.path.join(path, f"v{version}")
+    tmp = f"{base}.joblib.{os.getpid()}.tmp"
+    try:
+        with open(fd, "w", encoding="utf-8") as f:
+            json.dump(meta, f, indent=2)
+        joblib.dump({**bundle, **meta}, tmp)
+        os.replace(tmp, base + ".joblib")
+    except BaseException:
+        for p in (tmp, base + ".json"):
+            if os.path.exists(p):
+                os.remove(p)
+        raise
+    return meta
+
+def load_model(name: str, version: int | None = None) -> dict:
+    """Bundle for `name` at `version` (latest if None)."""
+    versions = _versions(name)
+    if not versions:
+        raise FileNotFoundError(f"No saved model named {name!r} in {MODEL_DIR}")
+    version = versions[-1] if version is None else int(version)
+    if version not in versions:
+        raise FileNotFoundError(f"Model {name!r} has no version {version}")
+    return joblib.load(os.path.join(MODEL_DIR, name, f"v{version}.joblib"))
+
+def list_models() -> list[dict]:
+    """Metadata for every saved version, newest first."""
+    out = []
+    if not os.path.isdir(MODEL_DIR):
+        return out
+    for name in os.listdir(MODEL_DIR):
+        for v in _versions(name):
+            try:
+                with open(os.path.join(MODEL_DIR, name, f"v{v}.json"), encoding="utf-8") as f:
+                    out.append(json.load(f))
+            except (OSError, ValueError):
+                out.append({"name": name, "version": v, "created": ""})
+    return sorted(out, key=lambda m: m.get("created", ""), reverse=True)
+
+def parse_model_ref(ref: str):
+    """'name' or 'name:3' -> (name, version | None)."""
+    name, _, version = ref.partition(":")
+    return name, (int(version.lstrip("v")) if version else None)
@@ -0,0 +1,100 @@
+# utils/paging.py
+"""
+Server-side paging for large in-memory tables (the scored invoices grid).
+
+Filtering and sorting run here with numpy/pandas on the full frame; only the
+requested page is handed to the grid, so each rerun serializes page_size rows
+instead of the whole table. The row order for a (table key, sort, filter)
+combination is cached, so paging through results only slices.
+"""
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+MAX_CACHED_ORDERS = 32
+_ORDERS = OrderedDict()
+_ORDERS_LOCK = threading.Lock()
+
+def _contains(s: pd.Series, needle: str) -> np.ndarray:
+    """Case-insensitive substring mask; categoricals test each category once."""
+    if isinstance(s.dtype, pd.CategoricalDtype):
+        hit = s.cat.categories.astype(str).str.contains(needle, case=False, regex=False)
+        codes = s.cat.codes.to_numpy()
+        return np.append(np.asarray(hit, dtype=bool), False)[codes]   # code -1 (NaN) -> False
+    return s.astype(str).str.contains(needle, case=False, regex=False).to_numpy(dtype=bool)
+
+def filter_mask(df: pd.DataFrame, filters: dict | None = None, text: str = "", text_columns=None) -> np.ndarray:
+    """
+    Rows matching every filter: {column: value} where a str is a substring match,
+    a (lo, hi) tuple an inclusive range (either end may be None) and anything
+    else an equality test. `text` must appear in at least one of text_columns.
+    """
+    mask = np.ones(len(df), dtype=bool)
+    for col, val in (filters or {}).items():
+        if col not in df.columns or val is None or val == "":
+            continue
+        s = df[col]
+        if isinstance(val, str):
+            mask &= _contains(s, val)
+        elif isinstance(val, tuple):
+            lo, hi = val
+            v = s.to_numpy()
+            if lo is not None:
+                mask &= v >= lo
+            if hi is not None:
+                mask &= v <= hi
+        else:
+            mask &= (s == val).to_numpy(dtype=bool)
+    if text:
+        any_hit = np.zeros(len(df), dtype=bool)
+        for col in text_columns or [c for c in df.columns if not pd.api.types.is_numeric_dtype(df[c])]:
+            if col in df.columns:
+                any_hit |= _contains(df[col], text)
+        mask &= any_hit
+    return mask
+
+def row_order(df: pd.DataFrame, sort_by=None, ascending=True, filters: dict | None = None,
+              text: str = "", text_columns=None, key=None) -> np.ndarray:
+    """
+    Positions of the matching rows in display order. Pass `key` (any hashable that
+    changes with the table's content) to cache the result across reruns.
+    """
+    sort_cols = [sort_by] if isinstance(sort_by, str) else list(sort_by or [])
+    cache_key = None
+    if key is not None:
+        cache_key = (key, tuple(sort_cols), tuple(np.atleast_1d(ascending)),
+                     tuple(sorted((filters or {}).items(), key=lambda kv: kv[0])), text,
+                     tuple(text_columns or ()))
+        with _ORDERS_LOCK:
+            if cache_key in _ORDERS:
+                _ORDERS.move_to_end(cache_key)
+                return _ORDERS[cache_key]
+
+    pos = np.flatnonzero(filter_mask(df, filters, text, text_columns))
+    if sort_cols:
+        sub = df[sort_cols].iloc[pos].reset_index(drop=True)
+        asc = ascending if isinstance(ascending, bool) else list(ascending)
+        pos = pos[sub.sort_values(sort_cols, ascending=asc, kind="stable", na_position="last").index.to_numpy()]
+
+    if cache_key is not None:
+        with _ORDERS_LOCK:
+            _ORDERS[cache_key] = pos
+            while len(_ORDERS) > MAX_CACHED_ORDERS:
+                _ORDERS.popitem(last=False)
+    return pos
+
+def page_count(total: int, page_size: int) -> int:
+    return max(1, -(-total // page_size))
+
+def get_page(df: pd.DataFrame, page: int = 1, page_size: int = 50, columns=None, **order_kwargs):
+    """
+    (rows of 1-based `page`, number of matching rows). order_kwargs go to
+    row_order(): sort_by, ascending, filters, text, text_columns, key.
+    """
+    pos = row_order(df, **order_kwargs)
+    page = min(max(1, int(page)), page_count(len(pos), page_size))
+    rows = pos[(page - 1) * page_size: page * page_size]
+    out = df.iloc[rows] if columns is None else df.iloc[rows][[c for c in columns if c in df.columns]]
+    return out, len(pos)
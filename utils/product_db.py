@@ -1,9 +1,11 @@
 # utils/product_db.py
-import os
+import os, sqlite3, threading
+from contextlib import closing
 import pandas as pd
-from rapidfuzz import process, fuzz
+from utils.search_index import SearchIndex, EXACT_FIELDS
+from utils.ingest import read_table, PRODUCT_DTYPES
 
-DB_PATH = os.path.join("data", "product_db.csv")
+DB_PATH = os.path.join("data", "product_db.csv")  # legacy CSV, imported into SQLite on first run
 
 COLUMNS = [
     "product_id",        # unique short id, e.g., APP-AP2
@@ -40,31 +42,287 @@ STARTER = [
      "image":"","notes":"Luxury example"},
 ]
 
-def _ensure_db():
+SQLITE_PATH = os.path.join("data", "product_db.sqlite")
+INDEXED = ["brand", "category", "gtin", "serial_prefix"]
+ORIG_ID = "_orig_id"   # hidden grid column: the product_id a row had when its page was served
+_UPSERT_SQL = (f"INSERT INTO products ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))}) "
+               f"ON CONFLICT(product_id) DO UPDATE SET "
+               + ", ".join(f"{c}=excluded.{c}" for c in COLUMNS if c != "product_id"))
+
+# Process-wide copy of the table and its search index, invalidated when the
+# SQLite files change; saves from this process patch the index in place
+_CACHE = {"sig": None, "df": None, "index_sig": None, "index": None, "db_file": None}
+_CACHE_LOCK = threading.Lock()
+
+def _connect() -> sqlite3.Connection:
+    con = sqlite3.connect(SQLITE_PATH, timeout=30)
+    con.execute("PRAGMA journal_mode=WAL")
+    return con
+
+def _create_schema(con: sqlite3.Connection):
+    cols = ", ".join(
+        "product_id TEXT PRIMARY KEY" if c == "product_id" else (f"{c} REAL" if c == "msrp" else f"{c} TEXT")
+        for c in COLUMNS
+    )
+    con.execute(f"CREATE TABLE IF NOT EXISTS products ({cols})")
+    for c in INDEXED:
+        con.execute(f"CREATE INDEX IF NOT EXISTS idx_products_{c} ON products({c})")
+
+def _text(v):
+    if v is None or (isinstance(v, float) and pd.isna(v)):
+        return None
+    v = str(v).strip()
+    return v or None
+
+def _normalized(df: pd.DataFrame) -> list[tuple]:
+    """Normalized (COLUMNS-ordered) tuple per row; empty text is stored as NULL."""
+    out = {}
+    for c in COLUMNS:
+        col = df[c] if c in df.columns else pd.Series([None] * len(df), index=df.index)
+        if c == "msrp":
+            out[c] = [None if pd.isna(v) else float(v) for v in pd.to_numeric(col, errors="coerce")]
+        else:
+            out[c] = [_text(v) for v in col]
+    return list(zip(*(out[c] for c in COLUMNS)))
+
+def _to_rows(df: pd.DataFrame) -> tuple[list[tuple], int]:
+    """(_normalized() rows keyed by product_id, number of rows skipped for having no product_id)."""
+    rows, skipped = {}, 0
+    for r in _normalized(df):
+        # product_id is the key: rows without one cannot be stored, duplicates keep the last
+        if r[0]:
+            rows[r[0]] = r
+        else:
+            skipped += 1
+    return list(rows.values()), skipped
+
+def _db_file():
+    try:
+        st = os.stat(SQLITE_PATH)
+    except FileNotFoundError:
+        return None
+    return st.st_dev, st.st_ino
+
+def init_db(seed: pd.DataFrame | None = None) -> bool:
+    """
+    Create the products table if it is missing and fill it with `seed` (default:
+    the legacy CSV if present, else the starter rows). An existing table is left
+    as is. Returns True if the table was created.
+    """
     os.makedirs("data", exist_ok=True)
-    if not os.path.exists(DB_PATH):
-        df = pd.DataFrame(STARTER)
-        for c in COLUMNS:
-            if c not in df.columns: df[c] = ""
-        df[COLUMNS].to_csv(DB_PATH, index=False)
+    with closing(_connect()) as con, con:
+        con.execute("BEGIN IMMEDIATE")  # one process seeds; the others wait and find the table
+        exists = con.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'products'").fetchone()
+        _create_schema(con)
+        if not exists:
+            if seed is None:
+                seed = read_table(DB_PATH, dtypes=PRODUCT_DTYPES) if os.path.exists(DB_PATH) else pd.DataFrame(STARTER)
+            upsert_products(seed, con=con)
+    _CACHE["db_file"] = _db_file()
+    return not exists
+
+def _ensure_db():
+    """init_db() unless this database file was already checked."""
+    db_file = _db_file()
+    if db_file is not None and _CACHE["db_file"] == db_file:
+        return
+    init_db()
+
+def _signature():
+    sig = []
+    for p in (SQLITE_PATH, SQLITE_PATH + "-wal"):
+        try:
+            st = os.stat(p)
+            sig.append((st.st_mtime_ns, st.st_size))
+        except FileNotFoundError:
+            sig.append(None)
+    return tuple(sig)
+
+def _table() -> pd.DataFrame:
+    """Cached table (shared, do not mutate)."""
+    _ensure_db()
+    with _CACHE_LOCK:
+        sig = _signature()
+        if _CACHE["sig"] != sig or _CACHE["df"] is None:
+            with closing(_connect()) as con:
+                df = pd.read_sql_query(f"SELECT {', '.join(COLUMNS)} FROM products ORDER BY rowid", con)
+            df["msrp"] = pd.to_numeric(df["msrp"], errors="coerce")
+            _CACHE.update(sig=sig, df=df[COLUMNS])
+        return _CACHE["df"]
 
 def load_db() -> pd.DataFrame:
+    return _table().copy()
+
+def _search_index() -> SearchIndex:
+    df = _table()
+    with _CACHE_LOCK:
+        if _CACHE["index"] is None or _CACHE["index_sig"] != _signature():
+            _CACHE.update(index=SearchIndex(df), index_sig=_signature())
+        return _CACHE["index"]
+
+def clear_cache():
+    """Forget the cached table, search index and checked database file (e.g. after switching directories)."""
+    with _CACHE_LOCK:
+        _CACHE.update(sig=None, df=None, index_sig=None, index=None, db_file=None)
+
+def _invalidate():
+    with _CACHE_LOCK:
+        _CACHE.update(sig=None, df=None)
+
+def _patch_index(before_sig, upserted: list | None = None, deleted=None):
+    """Apply this process's own write to the search index instead of rebuilding it."""
+    with _CACHE_LOCK:
+        index = _CACHE["index"]
+        if index is None or _CACHE["index_sig"] != before_sig:
+            _CACHE.update(index=None, index_sig=None)
+            return
+        if deleted:
+            index.delete(deleted)
+        if upserted:
+            index.upsert(pd.DataFrame(upserted, columns=COLUMNS))
+        if index.needs_rebuild():
+            _CACHE.update(index=None, index_sig=None)
+        else:
+            _CACHE["index_sig"] = _signature()
+
+def upsert_products(rows, con: sqlite3.Connection | None = None) -> dict:
+    """
+    Insert or update rows (DataFrame or list of dicts) by product_id.
+    Returns {"upserted", "skipped"}; skipped rows had no product_id.
+    """
+    df = rows if isinstance(rows, pd.DataFrame) else pd.DataFrame(list(rows))
+    data, skipped = _to_rows(df)
+    if not data:
+        return {"upserted": 0, "skipped": skipped}
+    if con is None:
+        _ensure_db()
+        before = _signature()
+        with closing(_connect()) as own, own:
+            own.executemany(_UPSERT_SQL, data)
+        _patch_index(before, upserted=data)
+    else:
+        con.executemany(_UPSERT_SQL, data)
+    _invalidate()
+    return {"upserted": len(data), "skipped": skipped}
+
+def delete_products(product_ids) -> int:
+    ids = [(str(p),) for p in product_ids]
+    if not ids:
+        return 0
     _ensure_db()
-    df = pd.read_csv(DB_PATH, dtype=str)
-    # fix dtypes
-    if "msrp" in df.columns:
-        df["msrp"] = pd.to_numeric(df["msrp"], errors="coerce")
-    for c in COLUMNS:
-        if c not in df.columns:
-            df[c] = "" if c != "msrp" else 0.0
-    return df[COLUMNS]
+    before = _signature()
+    with closing(_connect()) as con, con:
+        con.executemany("DELETE FROM products WHERE product_id = ?", ids)
+    _patch_index(before, deleted=[i[0] for i in ids])
+    _invalidate()
+    return len(ids)
 
 def save_db(df: pd.DataFrame):
-    df = df.copy()
-    for c in COLUMNS:
-        if c not in df.columns:
-            df[c] = "" if c != "msrp" else 0.0
-    df[COLUMNS].to_csv(DB_PATH, index=False)
+    """
+    Make the table match df, touching only rows that changed:
+    new/edited rows are upserted, rows missing from df are deleted.
+    Rows without a product_id are counted in "skipped"; a frame without the
+    product_id column is refused with ValueError rather than emptying the table.
+    """
+    if "product_id" not in df.columns:
+        raise ValueError("No product_id column")
+    current = load_db()
+    new_rows, skipped = _to_rows(df)
+    cur_rows = {r[0]: r for r in _to_rows(current)[0]}
+    changed = [r for r in new_rows if cur_rows.get(r[0]) != r]
+    removed = set(cur_rows) - {r[0] for r in new_rows}
+    if changed:
+        upsert_products(pd.DataFrame(changed, columns=COLUMNS))
+    if removed:
+        delete_products(removed)
+    return {"upserted": len(changed), "deleted": len(removed), "skipped": skipped}
+
+def _filter_clause(text: str = "", brands: list[str] | None = None, categories: list[str] | None = None):
+    """(WHERE clause, params) for a substring match on id / name / brand / model / sku / gtin plus facets."""
+    where, params = [], []
+    if text:
+        fields = ["product_id", "product_name", "brand", "model", "sku", "gtin"]
+        where.append("(" + " OR ".join(f"{c} LIKE ? ESCAPE '\\'" for c in fields) + ")")
+        like = "%" + text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        params += [like] * len(fields)
+    for col, values in (("brand", brands), ("category", categories)):
+        if values:
+            where.append(f"{col} IN ({', '.join('?' * len(values))})")
+            params += list(values)
+    return ("WHERE " + " AND ".join(where)) if where else "", params
+
+def count_products(text: str = "", brands: list[str] | None = None, categories: list[str] | None = None) -> int:
+    clause, params = _filter_clause(text, brands, categories)
+    _ensure_db()
+    with closing(_connect()) as con:
+        return con.execute(f"SELECT count(*) FROM products {clause}", params).fetchone()[0]
+
+def query_products(page: int = 1, page_size: int = 50, sort_by: str = "product_id", ascending: bool = True,
+                   text: str = "", brands: list[str] | None = None, categories: list[str] | None = None):
+    """
+    One page of the table straight from SQLite (LIMIT / OFFSET), for the catalog
+    editor; filters as in count_products(). Returns (rows, number of matching rows).
+    """
+    if sort_by not in COLUMNS:
+        raise ValueError(f"Unknown sort column {sort_by!r}")
+    clause, params = _filter_clause(text, brands, categories)
+    total = count_products(text, brands, categories)
+    page = min(max(1, int(page)), max(1, -(-total // page_size)))
+    order = f"{sort_by} {'ASC' if ascending else 'DESC'}, product_id"
+    with closing(_connect()) as con:
+        df = pd.read_sql_query(f"SELECT {', '.join(COLUMNS)} FROM products {clause} ORDER BY {order} "
+                               "LIMIT ? OFFSET ?", con, params=params + [page_size, (page - 1) * page_size])
+    df["msrp"] = pd.to_numeric(df["msrp"], errors="coerce")
+    return df, total
+
+def save_changes(original: pd.DataFrame, edited: pd.DataFrame) -> dict:
+    """
+    Apply grid edits for one served page. Rows are matched on ORIG_ID (the
+    product_id each row had when the page was served; empty for added rows), so
+    changes made by other sessions in between cannot shift them. Only rows that
+    differ are written; a changed product_id renames the product. Renames or new
+    rows onto an id that already exists (and is not vacated by this save) are
+    refused with ValueError. Everything is applied in one transaction.
+    """
+    before = {o: r for o, r in zip(original[ORIG_ID], _normalized(original)) if _text(o)}
+    origs = edited[ORIG_ID] if ORIG_ID in edited.columns else [None] * len(edited)
+    upserts, claims, vacated, skipped = [], [], set(), 0
+    for o, r in zip(origs, _normalized(edited)):
+        o = _text(o)
+        if not r[0]:
+            skipped += 1  # no product_id: cannot be stored
+            continue
+        if o is not None and before.get(o) == r:
+            continue
+        upserts.append(r)
+        if o != r[0]:
+            claims.append(r[0])  # new row or rename: the target id must be free
+            if o is not None:
+                vacated.add(o)
+    targets = [r[0] for r in upserts]
+    dupes = sorted({t for t in targets if targets.count(t) > 1})
+    if dupes:
+        raise ValueError(f"Duplicate product_id on this page: {', '.join(dupes)}")
+    removed = vacated - set(targets)
+    check = [t for t in claims if t not in vacated]
+    _ensure_db()
+    before_sig = _signature()
+    with closing(_connect()) as con, con:
+        con.execute("BEGIN IMMEDIATE")  # hold the write lock from the id check to the commit
+        taken = []
+        for i in range(0, len(check), 500):
+            part = check[i:i + 500]
+            taken += [x[0] for x in con.execute(
+                f"SELECT product_id FROM products WHERE product_id IN ({', '.join('?' * len(part))})", part)]
+        if taken:
+            raise ValueError(f"product_id already exists: {', '.join(sorted(taken))}")
+        if upserts:
+            con.executemany(_UPSERT_SQL, upserts)
+        if removed:
+            con.executemany("DELETE FROM products WHERE product_id = ?", [(i,) for i in removed])
+    _patch_index(before_sig, upserted=upserts, deleted=list(removed))
+    _invalidate()
+    return {"upserted": len(upserts), "deleted": len(removed), "skipped": skipped}
 
 def search_products(
     query: str = "",
@@ -74,49 +332,46 @@ def search_products(
 ) -> pd.DataFrame:
     """
     Fuzzy + filtered search across name, brand, model, product_id, and category.
+    Served from the prebuilt SearchIndex (facet bitmaps + trigram prefilter).
     """
-    df = load_db()
-    work = df.copy()
-
-    # Quick filters first
-    if brands:
-        work = work[work["brand"].isin(brands)]
-    if categories:
-        work = work[work["category"].isin(categories)]
-
-    if not query:
-        return work.head(max_results)
-
-    # Build a search corpus (concat fields)
-    work["_search"] = (
-        work["brand"].fillna("") + " " +
-        work["product_name"].fillna("") + " " +
-        work["model"].fillna("") + " " +
-        work["product_id"].fillna("") + " " +
-        work["category"].fillna("")
-    )
+    rows, scores = _search_index().search(query, brands=brands, categories=categories, limit=max_results)
+    matched = rows.copy()
+    if scores is not None:
+        matched.insert(0, "match_score", scores)
+    return matched
 
-    # RapidFuzz: return best matches by score
-    choices = work["_search"].tolist()
-    results = process.extract(
-        query,
-        choices,
-        scorer=fuzz.WRatio,
-        limit=min(max_results, len(choices)),
-    )
+def lookup_exact(value: str, fields: list[str] | None = None) -> pd.DataFrame:
+    """
+    Rows whose gtin / product_id / sku / model / serial_prefix equals value
+    (hash-map lookup, no scan). Adds a "match_field" column.
+    """
+    rows, matched = _search_index().exact(value, fields=fields or EXACT_FIELDS)
+    out = rows.copy()
+    out.insert(0, "match_field", matched)
+    return out
+
+def get_product(product_id: str) -> dict | None:
+    rows, _ = _search_index().exact(product_id, fields=["product_id"])
+    return rows.iloc[0].to_dict() if len(rows) else None
 
-    # Map back to rows
-    idxs = [r[2] for r in results]  # (match, score, index)
-    scores = [r[1] for r in results]
-    matched = work.iloc[idxs].copy()
-    matched.insert(0, "match_score", scores)
-    return matched.drop(columns=["_search"], errors="ignore")
+def products_by_gtin(gtin: str) -> pd.DataFrame:
+    return lookup_exact(gtin, ["gtin"]).drop(columns="match_field")
+
+def products_by_serial_prefix(prefix: str) -> pd.DataFrame:
+    return lookup_exact(prefix, ["serial_prefix"]).drop(columns="match_field")
+
+def _distinct(col: str) -> list[str]:
+    # Served from the column index, no table scan
+    _ensure_db()
+    with closing(_connect()) as con:
+        rows = con.execute(f"SELECT DISTINCT {col} FROM products WHERE {col} IS NOT NULL AND {col} != '' ORDER BY {col}").fetchall()
+    return [r[0] for r in rows]
 
 def distinct_brands() -> list[str]:
-    return sorted([b for b in load_db()["brand"].dropna().unique().tolist() if b])
+    return _distinct("brand")
 
 def distinct_categories() -> list[str]:
-    return sorted([c for c in load_db()["category"].dropna().unique().tolist() if c])
+    return _distinct("category")
 
 def blank_row() -> dict:
     return {c: (0.0 if c == "msrp" else "") for c in COLUMNS}
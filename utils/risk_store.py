@@ -0,0 +1,154 @@
+# utils/risk_store.py
+"""
+Incremental supplier risk history.
+
+Each scored batch is reduced to per-supplier, per-day sums (invoices,
+anomalies, score sum / count) and merged into SQLite under a batch id;
+re-merging a batch id replaces its earlier rows, so rescoring the same file
+does not double count. Batch ids default to a hash of the input's content
+(batch_id_for / batch_id_for_file), so the same data under another file name
+is the same batch. Streamed runs stage their chunks in a side table and swap
+them in with one transaction (commit_staged), so a failed run leaves the
+history untouched. Windowed risk (7 / 30 / 90 days, or all history) sums
+only the aggregate rows in the window and applies the same formula as
+supplier_risk_table, without touching raw invoices.
+"""
+import os, sqlite3, hashlib
+from contextlib import closing
+from datetime import date, timedelta
+
+import pandas as pd
+
+from utils.anomaly import supplier_daily_partials, risk_from_partials
+
+RISK_DB_PATH = os.path.join("data", "supplier_risk.sqlite")
+WINDOWS = (7, 30, 90)
+SUM_COLUMNS = ["total", "anomalies", "score_sum", "score_n"]
+
+def _connect(path: str) -> sqlite3.Connection:
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    con = sqlite3.connect(path, timeout=30)
+    con.execute("PRAGMA journal_mode=WAL")
+    con.execute("""CREATE TABLE IF NOT EXISTS supplier_daily (
+        batch_id TEXT NOT NULL, supplier TEXT NOT NULL, day TEXT NOT NULL,
+        total INTEGER NOT NULL, anomalies INTEGER NOT NULL, score_sum REAL NOT NULL, score_n INTEGER NOT NULL,
+        PRIMARY KEY (batch_id, supplier, day))""")
+    con.execute("CREATE INDEX IF NOT EXISTS idx_supplier_daily_day ON supplier_daily(day)")
+    con.execute("""CREATE TABLE IF NOT EXISTS supplier_daily_staging (
+        batch_id TEXT NOT NULL, supplier TEXT NOT NULL, day TEXT NOT NULL,
+        total INTEGER NOT NULL, anomalies INTEGER NOT NULL, score_sum REAL NOT NULL, score_n INTEGER NOT NULL,
+        PRIMARY KEY (batch_id, supplier, day))""")
+    con.execute("""CREATE TABLE IF NOT EXISTS batches (
+        batch_id TEXT PRIMARY KEY, rows INTEGER NOT NULL, first_day TEXT, last_day TEXT, merged_at TEXT NOT NULL)""")
+    return con
+
+def _rows(daily: pd.DataFrame, batch_id: str) -> list:
+    return list(zip([batch_id] * len(daily), daily["supplier"].astype(str), daily["day"],
+                    daily["total"].astype(int).tolist(), daily["anomalies"].astype(int).tolist(),
+                    daily["score_sum"].astype(float).tolist(), daily["score_n"].astype(int).tolist()))
+
+def merge_batch(scored: pd.DataFrame, batch_id: str, path: str = RISK_DB_PATH, daily: pd.DataFrame | None = None) -> dict:
+    """
+    Merge a scored frame (or its precomputed supplier_daily_partials, via `daily`)
+    into the store. Replaces anything stored earlier under the same batch_id.
+    """
+    daily = supplier_daily_partials(scored) if daily is None else daily
+    rows = _rows(daily, batch_id)
+    first, last = (daily["day"].min(), daily["day"].max()) if len(daily) else (None, None)
+    with closing(_connect(path)) as con, con:
+        con.execute("DELETE FROM supplier_daily WHERE batch_id = ?", (batch_id,))
+        con.executemany("INSERT INTO supplier_daily VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+        con.execute("INSERT OR REPLACE INTO batches VALUES (?, ?, ?, ?, datetime('now'))",
+                    (batch_id, int(daily["total"].sum()), first, last))
+    return {"batch_id": batch_id, "days": daily["day"].nunique(), "suppliers": daily["supplier"].nunique(),
+            "invoices": int(daily["total"].sum())}
+
+def batch_id_for(data: bytes) -> str:
+    """Content-hash batch id (the same prefix the app's score cache key starts with)."""
+    return hashlib.sha256(data).hexdigest()[:32]
+
+def batch_id_for_file(path: str, block: int = 1 << 20) -> str:
+    """batch_id_for() of a file's bytes, read in blocks."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(block):
+            h.update(chunk)
+    return h.hexdigest()[:32]
+
+def stage_daily(daily: pd.DataFrame, batch_id: str, path: str = RISK_DB_PATH):
+    """Add partials to the staging area of a batch (streaming: one call per chunk); see commit_staged()."""
+    if daily.empty:
+        return
+    with closing(_connect(path)) as con, con:
+        con.executemany(
+            "INSERT INTO supplier_daily_staging VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT(batch_id, supplier, day) "
+            "DO UPDATE SET " + ", ".join(f"{c} = {c} + excluded.{c}" for c in SUM_COLUMNS), _rows(daily, batch_id))
+
+def discard_staged(batch_id: str, path: str = RISK_DB_PATH):
+    with closing(_connect(path)) as con, con:
+        con.execute("DELETE FROM supplier_daily_staging WHERE batch_id = ?", (batch_id,))
+
+def commit_staged(batch_id: str, path: str = RISK_DB_PATH) -> dict:
+    """Replace the batch with its staged rows in one transaction; returns merge_batch()-style stats."""
+    cols = "batch_id, supplier, day, " + ", ".join(SUM_COLUMNS)
+    with closing(_connect(path)) as con, con:
+        con.execute("DELETE FROM supplier_daily WHERE batch_id = ?", (batch_id,))
+        con.execute(f"INSERT INTO supplier_daily ({cols}) SELECT {cols} FROM supplier_daily_staging WHERE batch_id = ?",
+                    (batch_id,))
+        con.execute("DELETE FROM supplier_daily_staging WHERE batch_id = ?", (batch_id,))
+        days, suppliers, invoices, first, last = con.execute(
+            "SELECT count(DISTINCT day), count(DISTINCT supplier), coalesce(sum(total), 0), min(day), max(day) "
+            "FROM supplier_daily WHERE batch_id = ?", (batch_id,)).fetchone()
+        con.execute("INSERT OR REPLACE INTO batches VALUES (?, ?, ?, ?, datetime('now'))",
+                    (batch_id, invoices, first, last))
+    return {"batch_id": batch_id, "days": days, "suppliers": suppliers, "invoices": invoices}
+
+def delete_batch(batch_id: str, path: str = RISK_DB_PATH):
+    with closing(_connect(path)) as con, con:
+        con.execute("DELETE FROM supplier_daily WHERE batch_id = ?", (batch_id,))
+        con.execute("DELETE FROM batches WHERE batch_id = ?", (batch_id,))
+
+def list_batches(path: str = RISK_DB_PATH) -> pd.DataFrame:
+    with closing(_connect(path)) as con:
+        return pd.read_sql_query("SELECT * FROM batches ORDER BY merged_at DESC", con)
+
+def history_range(path: str = RISK_DB_PATH):
+    """(first day, last day) stored, as "YYYY-MM-DD" strings, or (None, None) when empty."""
+    with closing(_connect(path)) as con:
+        return con.execute("SELECT min(day), max(day) FROM supplier_daily").fetchone()
+
+def window_partials(days: int | None = None, as_of: str | None = None, path: str = RISK_DB_PATH) -> pd.DataFrame:
+    """
+    Per-supplier sums over the `days` days ending at as_of (inclusive; default: the
+    latest stored day). days=None covers all history.
+    """
+    with closing(_connect(path)) as con:
+        if as_of is None:
+            as_of = con.execute("SELECT max(day) FROM supplier_daily").fetchone()[0]
+        where, params = "", []
+        if as_of is not None:
+            where, params = "WHERE day <= ?", [as_of]
+            if days is not None:
+                start = (date.fromisoformat(as_of) - timedelta(days=days - 1)).isoformat()
+                where += " AND day >= ?"
+                params.append(start)
+        sums = ", ".join(f"sum({c}) AS {c}" for c in SUM_COLUMNS)
+        return pd.read_sql_query(f"SELECT supplier, {sums} FROM supplier_daily {where} GROUP BY supplier", con,
+                                 params=params)
+
+def window_risk(days: int | None = None, as_of: str | None = None, path: str = RISK_DB_PATH) -> pd.DataFrame:
+    """supplier_risk_table() over a time window, computed from the stored aggregates."""
+    return risk_from_partials(window_partials(days, as_of, path))
+
+def risk_windows(windows=WINDOWS, as_of: str | None = None, path: str = RISK_DB_PATH) -> pd.DataFrame:
+    """One row per supplier: risk_<n>d and invoices_<n>d for each window, plus all-history columns."""
+    out = None
+    for w in list(windows) + [None]:
+        suffix = f"{w}d" if w else "all"
+        part = window_risk(w, as_of, path)[["supplier", "total", "risk_score"]]
+        part = part.rename(columns={"total": f"invoices_{suffix}", "risk_score": f"risk_{suffix}"})
+        out = part if out is None else out.merge(part, on="supplier", how="outer")
+    if out is None or out.empty:
+        return pd.DataFrame(columns=["supplier"])
+    first = f"risk_{windows[0]}d" if windows else "risk_all"
+    return out.sort_values([first, "risk_all"], ascending=False, na_position="last").reset_index(drop=True)
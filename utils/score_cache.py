@@ -0,0 +1,106 @@
+# utils/score_cache.py
+"""
+Content-addressed cache in front of the scoring pipeline.
+
+Key = sha256(input bytes) + contamination + random_state + model version, so
+identical requests return instantly across reruns and sessions. Entries live
+in an in-process LRU and, optionally, on disk as joblib files.
+"""
+import os, hashlib, threading
+from collections import OrderedDict
+
+import joblib
+
+CACHE_DIR = os.path.join("data", "cache", "scores")
+
+def cache_key(data: bytes, contamination: float, random_state: int = 42, model_version: str = "fresh") -> str:
+    h = hashlib.sha256(data).hexdigest()
+    params = f"{contamination:.6f}|{random_state}|{model_version}"
+    return f"{h[:32]}-{hashlib.sha256(params.encode()).hexdigest()[:16]}"
+
+class ScoreCache:
+    def __init__(self, max_entries: int = 16, disk_dir: str | None = None, max_disk_entries: int = 64):
+        self.max_entries = max_entries
+        self.disk_dir = disk_dir
+        self.max_disk_entries = max_disk_entries
+        self._mem = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, key + ".joblib")
+
+    def _touch(self, key: str):
+        # mtime doubles as last-access time for the disk LRU
+        try:
+            os.utime(self._disk_path(key))
+        except OSError:
+            pass
+
+    def get(self, key: str):
+        with self._lock:
+            if key in self._mem:
+                self._mem.move_to_end(key)
+                self.hits += 1
+                value = self._mem[key]
+            else:
+                value = None
+        if value is not None:
+            if self.disk_dir:
+                self._touch(key)
+            return value
+        if self.disk_dir and os.path.exists(self._disk_path(key)):
+            try:
+                value = joblib.load(self._disk_path(key))
+            except Exception:
+                value = None
+            if value is not None:
+                self._touch(key)
+                self._put_mem(key, value)
+                with self._lock:
+                    self.hits += 1
+                return value
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def _put_mem(self, key: str, value):
+        with self._lock:
+            self._mem[key] = value
+            self._mem.move_to_end(key)
+            while len(self._mem) > self.max_entries:
+                self._mem.popitem(last=False)
+
+    def put(self, key: str, value):
+        self._put_mem(key, value)
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            tmp = self._disk_path(key) + ".tmp"
+            joblib.dump(value, tmp)
+            os.replace(tmp, self._disk_path(key))
+            self._evict_disk()
+
+    def _evict_disk(self):
+        files = [os.path.join(self.disk_dir, f) for f in os.listdir(self.disk_dir) if f.endswith(".joblib")]
+        if len(files) <= self.max_disk_entries:
+            return
+        files.sort(key=os.path.getmtime)
+        for path in files[:len(files) - self.max_disk_entries]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def get_or_compute(self, key: str, compute):
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._mem.clear()
+
+# Process-wide instance shared by every Streamlit session
+SCORE_CACHE = ScoreCache(disk_dir=CACHE_DIR)
@@ -0,0 +1,165 @@
+# utils/search_index.py
+"""
+Prebuilt fuzzy search index over the product table.
+
+Built once per table version and updated incrementally on save:
+  - normalized search corpus (brand, name, model, id, category), processed once
+  - facet bitmaps (numpy bool arrays) per brand and per category
+  - trigram postings used to prefilter large catalogs, so only candidate rows
+    are scored with WRatio (rapidfuzz cdist, multi-threaded)
+  - hash maps for exact keys (gtin, product_id, sku, model, serial_prefix),
+    checked before any fuzzy scoring
+"""
+import numpy as np
+import pandas as pd
+from rapidfuzz import process, fuzz
+from rapidfuzz.utils import default_process
+
+SEARCH_FIELDS = ["brand", "product_name", "model", "product_id", "category"]
+FULL_SCAN_ROWS = 50_000   # below this, score every (facet-filtered) row
+MIN_CANDIDATES = 5_000    # prefilter keeps at least this many rows (or 20x the limit)
+REBUILD_RATIO = 0.2       # compact when this share of rows is stale
+EXACT_FIELDS = ["product_id", "gtin", "sku", "model", "serial_prefix"]
+
+def exact_key(field: str, value) -> str:
+    """Normalized lookup key: case/space-insensitive; GTINs compare as digits without leading zeros."""
+    if value is None or (isinstance(value, float) and pd.isna(value)):
+        return ""
+    v = str(value).strip().upper()
+    if field == "gtin":
+        v = "".join(ch for ch in v if ch.isdigit()).lstrip("0")
+    return v
+
+def _trigrams(text: str) -> set:
+    text = f"  {text} "
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+def _search_text(df: pd.DataFrame) -> list:
+    text = df[SEARCH_FIELDS[0]].fillna("").astype(str)
+    for c in SEARCH_FIELDS[1:]:
+        text = text + " " + df[c].fillna("").astype(str)
+    return [default_process(t) for t in text]
+
+class SearchIndex:
+    def __init__(self, df: pd.DataFrame):
+        self.frame = df.reset_index(drop=True)
+        self.corpus = _search_text(self.frame)
+        self.alive = np.ones(len(self.frame), dtype=bool)
+        self.pos = {pid: i for i, pid in enumerate(self.frame["product_id"])}
+        self.facets = {c: self._bitmaps(self.frame[c]) for c in ("brand", "category")}
+        postings = {}
+        for i, text in enumerate(self.corpus):
+            for g in _trigrams(text):
+                postings.setdefault(g, []).append(i)
+        self.postings = {g: np.array(v, dtype=np.int64) for g, v in postings.items()}
+        self._delta = {}  # trigram -> rows appended since the last build
+        self.keys = {f: {} for f in EXACT_FIELDS}
+        self._add_keys(self.frame, 0)
+
+    def __len__(self):
+        return int(self.alive.sum())
+
+    def _add_keys(self, rows: pd.DataFrame, start: int):
+        for f in EXACT_FIELDS:
+            m = self.keys[f]
+            for j, v in enumerate(rows[f]):
+                k = exact_key(f, v)
+                if k:
+                    m.setdefault(k, []).append(start + j)
+
+    @staticmethod
+    def _bitmaps(col: pd.Series) -> dict:
+        values = col.fillna("").astype(str).to_numpy()
+        return {v: values == v for v in pd.unique(values) if v}
+
+    # ---------- incremental maintenance ----------
+    def upsert(self, rows: pd.DataFrame):
+        """Tombstone old versions of these product_ids and append the new rows."""
+        rows = rows.reset_index(drop=True)
+        self.delete(rows["product_id"])
+        start = len(self.frame)
+        self.frame = pd.concat([self.frame, rows[self.frame.columns]], ignore_index=True)
+        new_text = _search_text(rows)
+        self.corpus.extend(new_text)
+        self.alive = np.concatenate([self.alive, np.ones(len(rows), dtype=bool)])
+        for c, maps in self.facets.items():
+            values = rows[c].fillna("").astype(str).to_numpy()
+            for v, bm in list(maps.items()):
+                maps[v] = np.concatenate([bm, values == v])
+            for v in pd.unique(values):
+                if v and v not in maps:
+                    maps[v] = np.concatenate([np.zeros(start, dtype=bool), values == v])
+        self._add_keys(rows, start)
+        for j, text in enumerate(new_text):
+            self.pos[rows.at[j, "product_id"]] = start + j
+            for g in _trigrams(text):
+                self._delta.setdefault(g, []).append(start + j)
+
+    def delete(self, product_ids):
+        for pid in product_ids:
+            i = self.pos.pop(pid, None)
+            if i is not None:
+                self.alive[i] = False
+
+    def needs_rebuild(self) -> bool:
+        return len(self.alive) > 0 and (1 - self.alive.mean()) > REBUILD_RATIO
+
+    # ---------- queries ----------
+    def facet_mask(self, brands=None, categories=None) -> np.ndarray:
+        mask = self.alive.copy()
+        for col, wanted in (("brand", brands), ("category", categories)):
+            if wanted:
+                m = np.zeros(len(mask), dtype=bool)
+                for v in wanted:
+                    if v in self.facets[col]:
+                        m |= self.facets[col][v]
+                mask &= m
+        return mask
+
+    def exact(self, value, fields=EXACT_FIELDS, mask: np.ndarray | None = None):
+        """(frame rows, matched field per row) whose exact keys equal value; O(1) per field."""
+        mask = self.alive if mask is None else mask
+        hits, matched, seen = [], [], set()
+        for f in fields:
+            for i in self.keys[f].get(exact_key(f, value), ()):
+                if mask[i] and i not in seen:
+                    seen.add(i)
+                    hits.append(i)
+                    matched.append(f)
+        return self.frame.iloc[hits], matched
+
+    def _candidates(self, q: str, mask: np.ndarray, limit: int) -> np.ndarray:
+        rows = np.flatnonzero(mask)
+        if len(rows) <= FULL_SCAN_ROWS:
+            return rows
+        grams = _trigrams(q)
+        lists = [self.postings[g] for g in grams if g in self.postings]
+        lists += [np.array(self._delta[g], dtype=np.int64) for g in grams if g in self._delta]
+        if not lists:
+            return rows
+        counts = np.bincount(np.concatenate(lists), minlength=len(mask))
+        counts[~mask] = 0
+        keep = max(MIN_CANDIDATES, 20 * limit)
+        hit = np.flatnonzero(counts)
+        if len(hit) > keep:
+            hit = hit[np.argpartition(-counts[hit], keep - 1)[:keep]]
+        return np.sort(hit)
+
+    def search(self, query: str, brands=None, categories=None, limit: int = 200):
+        """(frame rows, scores) ordered by WRatio score, best first; no query = filtered rows in table order."""
+        mask = self.facet_mask(brands, categories)
+        q = default_process(query or "")
+        if not q:
+            return self.frame.iloc[np.flatnonzero(mask)[:limit]], None
+        # Pasted barcode / ID / model: answer from the hash maps, skip fuzzy scoring
+        rows, _ = self.exact(query, mask=mask)
+        if len(rows):
+            return rows.iloc[:limit], np.full(min(len(rows), limit), 100.0)
+        cand = self._candidates(q, mask, limit)
+        if len(cand) == 0:
+            return self.frame.iloc[[]], np.array([])
+        choices = [self.corpus[i] for i in cand]
+        scores = process.cdist([q], choices, scorer=fuzz.WRatio, dtype=np.float64,
+                               workers=-1 if len(choices) > 10_000 else 1)[0]
+        top = np.argsort(-scores, kind="stable")[:limit]
+        return self.frame.iloc[cand[top]], scores[top]
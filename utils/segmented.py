@@ -0,0 +1,141 @@
+# utils/segmented.py
+"""
+Segmented baselines: one IsolationForest per supplier, per item, per
+supplier x item, or per cluster of items with similar price / quantity
+profiles, so "normal" is judged against comparable invoices.
+
+Segments are fitted and scored in a process pool. Segments with fewer than
+min_rows training rows (and values never seen in training) fall back to the
+global forest. Scores land in the usual anomaly_score / is_anomaly /
+reason_top_features columns, plus model_segment naming the forest used.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import IsolationForest
+from sklearn.cluster import KMeans
+
+from utils.anomaly import (
+    NUMERIC_FEATURES, prepare_dataframe, feature_medians, zscore_stats,
+    top_feature_reasons,
+)
+
+SEGMENT_BY = ["supplier", "item", "supplier_item", "cluster"]
+MIN_SEGMENT_ROWS = 200
+N_CLUSTERS = 8
+PARALLEL_MIN_ROWS = 50_000   # below this, pool start-up costs more than it saves
+GLOBAL = "__global__"
+
+def _item_profiles(df: pd.DataFrame) -> pd.DataFrame:
+    return np.log1p(df.groupby("item", observed=True)[["unit_price", "quantity"]].median().clip(lower=0))
+
+def _fit_clusters(df: pd.DataFrame, n_clusters: int, random_state: int) -> dict:
+    """item -> cluster label, from KMeans over per-item median log price / quantity."""
+    prof = _item_profiles(df)
+    if len(prof) == 0:
+        return {}
+    k = min(n_clusters, len(prof))
+    z = (prof - prof.mean()) / prof.std(ddof=0).replace(0, 1)
+    labels = KMeans(n_clusters=k, n_init=10, random_state=random_state).fit_predict(z.to_numpy())
+    return {item: f"cluster-{c}" for item, c in zip(prof.index, labels)}
+
+def segment_keys(df: pd.DataFrame, by: str, clusters: dict | None = None) -> pd.Series:
+    """Segment label per row (NaN where the row has no usable key)."""
+    if by == "supplier":
+        return df["supplier"].astype("string")
+    if by == "item":
+        return df["item"].astype("string")
+    if by == "supplier_item":
+        return df["supplier"].astype("string") + " | " + df["item"].astype("string")
+    if by == "cluster":
+        return df["item"].map(clusters or {}).astype("string")
+    raise ValueError(f"segment_by must be one of {SEGMENT_BY}")
+
+def _fit_one(task):
+    key, X, contamination, random_state = task
+    clf = IsolationForest(contamination=contamination, random_state=random_state).fit(X)
+    return key, clf
+
+def _score_one(task):
+    key, X, clf = task
+    return key, -clf.score_samples(X), clf.predict(X) == -1
+
+def _map(fn, tasks: list, workers: int | None, rows: int) -> list:
+    if workers == 1 or len(tasks) < 2 or rows < PARALLEL_MIN_ROWS:
+        return [fn(t) for t in tasks]
+    with ProcessPoolExecutor(max_workers=workers or min(len(tasks), os.cpu_count() or 1)) as pool:
+        return list(pool.map(fn, tasks))
+
+def fit_segmented_model(df: pd.DataFrame, segment_by: str = "supplier", contamination: float = 0.07,
+                        random_state: int = 42, min_rows: int = MIN_SEGMENT_ROWS,
+                        n_clusters: int = N_CLUSTERS, workers: int | None = None, inplace: bool = False):
+    """
+    Fit the global forest plus one forest per segment with >= min_rows rows.
+    Returns (scored frame, bundle); the bundle scores new data via score_segmented().
+    """
+    if segment_by not in SEGMENT_BY:
+        raise ValueError(f"segment_by must be one of {SEGMENT_BY}")
+    medians = feature_medians(df)
+    prepared = prepare_dataframe(df, medians, copy=not inplace)
+    clusters = _fit_clusters(prepared, n_clusters, random_state) if segment_by == "cluster" else None
+
+    keys = segment_keys(prepared, segment_by, clusters)
+    sizes = keys.value_counts()
+    big = [k for k, n in sizes.items() if n >= min_rows]
+    X = prepared[NUMERIC_FEATURES].to_numpy(dtype=float)
+    tasks = [(GLOBAL, X, contamination, random_state)]
+    tasks += [(k, X[(keys == k).to_numpy(dtype=bool)], contamination, random_state) for k in big]
+    segments = dict(_map(_fit_one, tasks, workers, len(prepared)))
+    global_clf = segments.pop(GLOBAL)
+    zstats = {k: zscore_stats(prepared[(keys == k).to_numpy(dtype=bool)]) for k in segments}
+    zstats[GLOBAL] = zscore_stats(prepared)
+
+    bundle = {
+        "kind": "segmented",
+        "segment_by": segment_by,
+        "segments": segments,
+        "segment_zstats": zstats,
+        "clusters": clusters,
+        "min_rows": min_rows,
+        "clf": global_clf,
+        "medians": medians,
+        "zstats": zstats[GLOBAL],
+        "features": list(NUMERIC_FEATURES),
+        "contamination": contamination,
+        "random_state": random_state,
+        "trained_rows": len(prepared),
+        "n_segments": len(segments),
+    }
+    return score_segmented(prepared, bundle, workers=workers, inplace=True), bundle
+
+def score_segmented(df: pd.DataFrame, bundle: dict, workers: int | None = None, inplace: bool = False) -> pd.DataFrame:
+    """
+    Score each row with its segment's forest (global forest for small / unseen segments).
+    inplace=True adds the score columns to `df` instead of a copy.
+    """
+    df = prepare_dataframe(df, bundle["medians"], copy=not inplace)
+    keys = segment_keys(df, bundle["segment_by"], bundle.get("clusters"))
+    used = keys.where(keys.isin(list(bundle["segments"]))).fillna(GLOBAL)
+    X = df[NUMERIC_FEATURES].to_numpy(dtype=float)
+
+    groups = {k: np.flatnonzero((used == k).to_numpy(dtype=bool)) for k in pd.unique(used)}
+    tasks = [(k, X[idx], bundle["segments"].get(k, bundle["clf"])) for k, idx in groups.items()]
+    scores = np.zeros(len(df))
+    flags = np.zeros(len(df), dtype=bool)
+    z = np.zeros_like(X)
+    for k, s, a in _map(_score_one, tasks, workers, len(df)):
+        idx = groups[k]
+        scores[idx], flags[idx] = s, a
+        # Reasons are explained against the segment's own baseline
+        stats = bundle["segment_zstats"].get(k, bundle["zstats"])
+        for j, c in enumerate(NUMERIC_FEATURES):
+            mu, sd = stats[c]
+            z[idx, j] = (X[idx, j] - mu) / sd
+
+    df["anomaly_score"] = scores
+    df["is_anomaly"] = flags
+    df["reason_top_features"] = top_feature_reasons(pd.DataFrame(np.abs(z), columns=NUMERIC_FEATURES, index=df.index))
+    df["model_segment"] = used.replace(GLOBAL, "global").to_numpy()
+    return df
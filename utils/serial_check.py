@@ -1,4 +1,7 @@
-import re
+import re, os, hashlib, threading
+
+import numpy as np
+import pandas as pd
 
 # Example: Brand serials look like "BRD-2025-XXXXXX" where X are digits, last digit is Luhn-like check.
 SERIAL_PATTERN = re.compile(r"^[A-Z]{3}-\d{4}-\d{6}$")
@@ -25,3 +28,139 @@ def validate_serial(serial: str):
         "checksum_ok": checksum_ok,
         "valid": basic and checksum_ok
     }
+
+# ---------- Bulk validation ----------
+ALLOWLIST_PATH = os.path.join("data", "serial_allowlist.txt")
+BLOOM_THRESHOLD = 5_000_000  # above this many serials, keep a Bloom filter instead of the sorted array
+BLOOM_BLOCK = 65_536         # items hashed per vectorized block (bounds the (n, k) position array)
+
+def luhn_like_many(serials) -> np.ndarray:
+    """
+    luhn_like() for a whole column: strings become a (n, width) code-point
+    matrix, non-digits are masked out, and each digit's parity is its rank
+    counted from the right, all in numpy.
+    """
+    arr = np.asarray(serials, dtype=str)
+    if arr.size == 0 or arr.dtype.itemsize == 0:
+        return np.zeros(arr.size, dtype=np.int64)
+    width = arr.dtype.itemsize // 4
+    codes = arr.view(np.uint32).reshape(len(arr), width)
+    is_digit = (codes >= 48) & (codes <= 57)
+    d = np.where(is_digit, codes - 48, 0).astype(np.uint8)
+    rank = np.cumsum(is_digit[:, ::-1], axis=1, dtype=np.int32)[:, ::-1]   # 1 = rightmost digit
+    v = np.where(is_digit & (rank % 2 == 0), d * 2, d)
+    v = np.where(v > 9, v - 9, v)
+    return v.sum(axis=1, dtype=np.int64) % 10
+
+class BloomFilter:
+    def __init__(self, n_items: int, fp_rate: float = 1e-4):
+        n_items = max(1, n_items)
+        self.m = int(np.ceil(-n_items * np.log(fp_rate) / (np.log(2) ** 2)))
+        self.k = max(1, int(round(self.m / n_items * np.log(2))))
+        self.bits = np.zeros((self.m + 7) // 8, dtype=np.uint8)
+
+    def _positions(self, items) -> np.ndarray:
+        """(n, k) bit positions per item: double hashing (h1 + i * h2) % m over one blake2b digest each."""
+        digests = b"".join(hashlib.blake2b(it.encode("utf-8"), digest_size=16).digest() for it in items)
+        h = np.frombuffer(digests, dtype="<u8").reshape(-1, 2)
+        m = np.uint64(self.m)
+        # Reduced mod m first, so i * h2 stays far below 2**64 and matches the arbitrary-precision formula
+        h1, h2 = h[:, 0] % m, (h[:, 1] | np.uint64(1)) % m
+        return (h1[:, None] + np.arange(self.k, dtype=np.uint64) * h2[:, None]) % m
+
+    def _blocks(self, items):
+        items = list(items)
+        for start in range(0, len(items), BLOOM_BLOCK):
+            yield start, self._positions(items[start:start + BLOOM_BLOCK])
+
+    def add_many(self, items):
+        for _, pos in self._blocks(items):
+            np.bitwise_or.at(self.bits, pos >> np.uint64(3), (1 << (pos & np.uint64(7))).astype(np.uint8))
+
+    def contains_many(self, items) -> np.ndarray:
+        items = list(items)
+        out = np.zeros(len(items), dtype=bool)
+        for start, pos in self._blocks(items):
+            hit = (self.bits[pos >> np.uint64(3)] >> (pos & np.uint64(7)).astype(np.uint8)) & 1
+            out[start:start + len(pos)] = hit.all(axis=1)
+        return out
+
+class AllowList:
+    """Known-good serials as a sorted array (exact) or a Bloom filter (compact, tiny false-positive rate)."""
+    def __init__(self, serials, bloom: bool | None = None):
+        values = pd.unique(pd.Series(list(serials), dtype=object).dropna().astype(str).str.strip().str.upper())
+        values = [v for v in values if v]
+        self.size = len(values)
+        self.bloom = None
+        self.sorted = None
+        if bloom if bloom is not None else self.size > BLOOM_THRESHOLD:
+            self.bloom = BloomFilter(self.size)
+            self.bloom.add_many(values)
+        else:
+            self.sorted = np.sort(np.array(values, dtype=str))
+
+    def __len__(self):
+        return self.size
+
+    def contains(self, serials, normalized: bool = False) -> np.ndarray:
+        if normalized:
+            q = np.asarray(serials, dtype=str)
+        else:
+            q = np.array([str(s).strip().upper() for s in serials], dtype=str)
+        if self.bloom is not None:
+            return self.bloom.contains_many(q)
+        if self.size == 0:
+            return np.zeros(len(q), dtype=bool)
+        pos = np.searchsorted(self.sorted, q)
+        return self.sorted[np.minimum(pos, self.size - 1)] == q
+
+_ALLOW = {"sig": None, "list": None}
+_ALLOW_LOCK = threading.Lock()
+
+def load_allowlist(path: str = ALLOWLIST_PATH) -> AllowList:
+    """Persistent allow-list (one serial per line), loaded once per file version."""
+    try:
+        st = os.stat(path)
+        sig = (path, st.st_mtime_ns, st.st_size)
+    except FileNotFoundError:
+        sig = (path, None, 0)
+    with _ALLOW_LOCK:
+        if _ALLOW["sig"] != sig:
+            serials = []
+            if sig[1] is not None:
+                with open(path, encoding="utf-8") as f:
+                    serials = f.read().splitlines()
+            _ALLOW.update(sig=sig, list=AllowList(serials))
+        return _ALLOW["list"]
+
+def add_to_allowlist(serials, path: str = ALLOWLIST_PATH) -> int:
+    new = [s.strip().upper() for s in serials if s and s.strip()]
+    if not new:
+        return 0
+    known = load_allowlist(path)
+    new = [s for s, hit in zip(new, known.contains(new)) if not hit]
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "a", encoding="utf-8") as f:
+        f.write("".join(s + "\n" for s in dict.fromkeys(new)))
+    return len(new)
+
+def validate_serials(serials, allowlist: AllowList | None = None, known_prefixes=None) -> pd.DataFrame:
+    """
+    validate_serial() for a whole column / list at once.
+    Columns: serial, normalized, format_ok, checksum_ok, valid, prefix, and
+    (when given) in_allowlist and prefix_known (prefix present in the product DB).
+    """
+    raw = pd.Series(list(serials), dtype=object).fillna("").astype(str)
+    norm = raw.str.strip().str.upper()
+    out = pd.DataFrame({"serial": raw, "normalized": norm})
+    out["format_ok"] = norm.str.fullmatch(SERIAL_PATTERN.pattern).fillna(False).astype(bool)
+    arr = norm.to_numpy(dtype=str)
+    out["checksum_ok"] = luhn_like_many(arr) == 0
+    out["valid"] = out["format_ok"] & out["checksum_ok"]
+    out["prefix"] = [v.partition("-")[0] for v in norm.tolist()]
+    if allowlist is not None:
+        out["in_allowlist"] = allowlist.contains(arr, normalized=True)
+    if known_prefixes is not None:
+        known = {str(p).strip().upper() for p in known_prefixes if isinstance(p, str) and p.strip()}
+        out["prefix_known"] = out["prefix"].isin(known)
+    return out
@@ -0,0 +1,125 @@
+# utils/streaming.py
+"""
+Out-of-core invoice scoring: memory stays bounded by chunksize + sample size,
+whatever the input size. Input may be CSV, Parquet or Arrow IPC; the sampling
+pass reads only the columns it needs.
+
+Pass 1 (skipped when a saved model is given) draws a uniform reservoir sample
+of rows to fit the forest and derive imputation medians. Pass 2 scores each
+chunk with that model and appends it to the output file, while per-supplier
+sums are merged for the risk table.
+"""
+import time
+
+import numpy as np
+import pandas as pd
+
+from utils.anomaly import NUMERIC_FEATURES, supplier_partials, supplier_daily_partials, merge_partials, risk_from_partials
+from utils.model_store import fit_reference_model, score_with_model
+from utils.segmented import MIN_SEGMENT_ROWS
+from utils.ingest import iter_batches
+from utils import risk_store
+
+def iter_chunks(src, chunksize: int = 200_000, columns=None):
+    """Typed chunks from a CSV / Parquet / Arrow path or file object (see utils.ingest)."""
+    return iter_batches(src, chunksize, columns=columns)
+
+def reservoir_sample(src, sample_rows: int = 200_000, chunksize: int = 200_000, seed: int = 42,
+                     extra_columns=()) -> pd.DataFrame:
+    """
+    Uniform sample of up to sample_rows rows (NUMERIC_FEATURES plus extra_columns) in one pass.
+    Each row gets a random key and the smallest keys are kept (bottom-k sampling).
+    """
+    rng = np.random.default_rng(seed)
+    columns = list(NUMERIC_FEATURES) + list(extra_columns)
+    sample = None
+    for chunk in iter_chunks(src, chunksize, columns=columns):
+        chunk = chunk.reindex(columns=columns)
+        chunk["_key"] = rng.random(len(chunk))
+        sample = chunk if sample is None else pd.concat([sample, chunk], ignore_index=True)
+        if len(sample) > sample_rows:
+            sample = sample.nsmallest(sample_rows, "_key")
+    if sample is None:
+        return pd.DataFrame(columns=columns)
+    return sample.drop(columns="_key").reset_index(drop=True)
+
+class ChunkWriter:
+    """Appends scored chunks to .parquet (one row group per chunk) or .csv."""
+    def __init__(self, path: str):
+        self.path = path
+        self.is_parquet = path.lower().endswith((".parquet", ".pq"))
+        self._writer = None
+        self._columns = None
+
+    def write(self, df: pd.DataFrame):
+        if self._columns is None:
+            self._columns = list(df.columns)
+        df = df.reindex(columns=self._columns)
+        # Text columns can be inferred differently per chunk; pin them to str
+        for c in df.columns:
+            if c not in NUMERIC_FEATURES and c not in ("anomaly_score", "is_anomaly"):
+                df[c] = df[c].astype("string")
+        if self.is_parquet:
+            import pyarrow as pa, pyarrow.parquet as pq
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            if self._writer is None:
+                self._writer = pq.ParquetWriter(self.path, table.schema)
+            self._writer.write_table(table.cast(self._writer.schema))
+        else:
+            df.to_csv(self.path, mode="a" if self._writer else "w", header=self._writer is None, index=False)
+            self._writer = True
+
+    def close(self):
+        if self.is_parquet and self._writer is not None:
+            self._writer.close()
+
+def score_stream(src, out_path: str, bundle: dict | None = None,
+                 contamination: float = 0.07, random_state: int = 42,
+                 chunksize: int = 200_000, sample_rows: int = 200_000, log=print,
+                 risk_batch: str | None = None, risk_path: str = risk_store.RISK_DB_PATH,
+                 segment_by: str | None = None, min_segment_rows: int = MIN_SEGMENT_ROWS,
+                 workers: int | None = None):
+    """
+    Score `src` chunk by chunk into `out_path`.
+    Without a bundle, fits on a sample (segmented forests when segment_by is set,
+    with min_segment_rows and workers as in fit_reference_model()).
+    With risk_batch, per-supplier daily sums are staged per chunk and swapped into
+    the risk history under that batch id at the end (replacing an earlier run of
+    the same batch); a run that fails part-way leaves the history unchanged.
+    Returns (stats dict, supplier risk table, model bundle used).
+    """
+    t0 = time.perf_counter()
+    if bundle is None:
+        sample = reservoir_sample(src, sample_rows=sample_rows, chunksize=chunksize, seed=random_state,
+                                  extra_columns=["supplier", "item"] if segment_by else ())
+        _, bundle = fit_reference_model(sample, contamination=contamination, random_state=random_state,
+                                        segment_by=segment_by, min_segment_rows=min_segment_rows, workers=workers)
+        log(f"fitted on a {len(sample):,}-row sample in {time.perf_counter() - t0:.1f}s")
+
+    writer = ChunkWriter(out_path)
+    partials = None
+    rows = 0
+    if risk_batch:
+        risk_store.discard_staged(risk_batch, risk_path)
+    try:
+        for chunk in iter_chunks(src, chunksize):
+            scored = score_with_model(chunk, bundle, inplace=True, workers=workers)
+            writer.write(scored)
+            part = supplier_partials(scored)
+            partials = part if partials is None else merge_partials(partials, part)
+            if risk_batch:
+                risk_store.stage_daily(supplier_daily_partials(scored), risk_batch, risk_path)
+            rows += len(scored)
+            log(f"scored {rows:,} rows ({rows / (time.perf_counter() - t0):,.0f} rows/s)")
+        if risk_batch:
+            risk_store.commit_staged(risk_batch, risk_path)
+    except BaseException:
+        if risk_batch:
+            risk_store.discard_staged(risk_batch, risk_path)
+        raise
+    finally:
+        writer.close()
+
+    risk = risk_from_partials(partials) if partials is not None else pd.DataFrame()
+    stats = {"rows": rows, "seconds": round(time.perf_counter() - t0, 3), "suppliers": len(risk)}
+    return stats, risk, bundle
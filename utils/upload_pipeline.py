@@ -0,0 +1,54 @@
+# utils/upload_pipeline.py
+"""
+Background decode + hash for uploaded photos.
+
+A 12-48 MP phone photo is decoded once, straight to WORK_SIZE via JPEG draft
+mode, on a worker thread. The same small RGB image is hashed and used as the
+on-screen preview, so nothing touches the full-resolution bitmap twice.
+Results are memoized by content hash, so reruns of the same upload are free.
+"""
+import io, time, hashlib, threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, Future
+
+from PIL import Image
+
+from utils.image_match import WORK_SIZE, decode_image, query_hashes
+
+MAX_RESULTS = 32  # decoded uploads kept in memory (preview + hashes)
+
+_POOL = ThreadPoolExecutor(max_workers=2, thread_name_prefix="upload-decode")
+_RESULTS = OrderedDict()   # sha1 -> Future
+_LOCK = threading.Lock()
+
+def _process(data: bytes, max_side: int) -> dict:
+    t0 = time.perf_counter()
+    with Image.open(io.BytesIO(data)) as im:
+        original_size = im.size
+    preview = decode_image(io.BytesIO(data), max_side)
+    t1 = time.perf_counter()
+    hashes = query_hashes(preview)
+    return {
+        "preview": preview,
+        "hashes": hashes,
+        "original_size": original_size,
+        "decode_ms": round(1000 * (t1 - t0), 1),
+        "hash_ms": round(1000 * (time.perf_counter() - t1), 1),
+    }
+
+def submit(data: bytes, max_side: int = WORK_SIZE) -> Future:
+    """
+    Start decoding + hashing an upload in the background and return its Future.
+    Result: {"preview", "hashes", "original_size", "decode_ms", "hash_ms"}.
+    """
+    key = hashlib.sha1(data).hexdigest() + f"-{max_side}"
+    with _LOCK:
+        fut = _RESULTS.get(key)
+        if fut is not None and not (fut.done() and fut.exception() is not None):
+            _RESULTS.move_to_end(key)
+            return fut
+        fut = _POOL.submit(_process, data, max_side)
+        _RESULTS[key] = fut
+        while len(_RESULTS) > MAX_RESULTS:
+            _RESULTS.popitem(last=False)
+        return fut